@@ -1,18 +1,587 @@
 import sys
 import os
-import random
-import string
+import time
+import hmac
+import json
+import hashlib
+import threading
+import multiprocessing
 import pydicom
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
                              QLabel, QSlider, QWidget, QPushButton, QFileDialog,
-                             QTableWidget, QTableWidgetItem, QTabWidget, QLineEdit,
-                             QMessageBox, QListWidget, QSplitter, QInputDialog,QToolBar,QAction)
+                             QTreeView, QListView, QTabWidget, QLineEdit,
+                             QMessageBox, QListWidget, QSplitter, QInputDialog,QToolBar,QAction,
+                             QProgressDialog)
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtCore import Qt, QThread, QTimer
-import matplotlib.pyplot as plt
+try:
+    from pydicom.pixels import pixel_array as read_pixel_frame  # pydicom >= 3 decodes a single frame from the file
+except ImportError:
+    read_pixel_frame = None
+from PyQt5.QtCore import (Qt, QThread, QTimer, QEvent, QSize, pyqtSignal, QAbstractItemModel, QAbstractListModel,
+                          QModelIndex, QSortFilterProxyModel)
+
+
+def modality_value_table(slope, intercept, signed):
+    """Modality values (after RescaleSlope/Intercept) for every 16-bit stored pixel value, indexed by bit pattern"""
+    stored = np.arange(65536, dtype=np.uint16)
+    if signed:
+        stored = stored.view(np.int16)
+    return stored * slope + intercept
+
+
+def window_lut(values, center, width):
+    """Map modality values to display bytes with the DICOM linear VOI window function"""
+    lut = (values - (center - 0.5)) / max(width - 1, 1) + 0.5
+    np.clip(lut, 0, 1, out=lut)
+    return (lut * 255).astype(np.uint8)
+
+
+def native_frame(dataset, index):
+    """View one frame of uncompressed grayscale or RGB pixel data, or return None when it needs a decoder"""
+    file_meta = getattr(dataset, 'file_meta', None)
+    syntax = file_meta.get('TransferSyntaxUID') if file_meta is not None else None
+    bits, representation = dataset.get('BitsAllocated'), dataset.get('PixelRepresentation', 0)
+    # Big endian OW data is swapped in 16-bit words, so only 16-bit samples can be read from it as stored
+    if (syntax is None or syntax.is_compressed or bits not in (8, 16, 32)
+            or (not syntax.is_little_endian and bits != 16)
+            or (representation and dataset.get('BitsStored') != bits)
+            or dataset.get('PhotometricInterpretation') not in ('MONOCHROME1', 'MONOCHROME2', 'RGB')):
+        return None
+    rows, columns, samples = dataset.Rows, dataset.Columns, int(dataset.get('SamplesPerPixel', 1))
+    dtype = np.dtype(f"{'i' if representation else 'u'}{bits // 8}").newbyteorder(
+        '<' if syntax.is_little_endian else '>')
+    count = rows * columns * samples
+    frame = np.frombuffer(dataset.PixelData, dtype=dtype, count=count, offset=index * count * dtype.itemsize)
+    if samples > 1 and dataset.get('PlanarConfiguration', 0):
+        frame = frame.reshape(samples, rows, columns).transpose(1, 2, 0)
+    else:
+        frame = frame.reshape((rows, columns, samples) if samples > 1 else (rows, columns))
+    return frame.astype(dtype.newbyteorder('='))
+
+
+def decode_frame(file_path, dataset, index):
+    """Decode one frame of a file; (rows, columns) for grayscale, (rows, columns, 3) RGB for color.
+
+    With pydicom 3 only that frame is read and decoded from the file, including encapsulated JPEG, JPEG 2000
+    and RLE data. Older versions view native data directly and decode other data in full.
+    """
+    if read_pixel_frame is not None:
+        return read_pixel_frame(file_path, index=index)
+    frame = native_frame(dataset, index)
+    if frame is None:
+        pixels = dataset.pixel_array
+        frame = pixels[index] if int(dataset.get('NumberOfFrames', 1) or 1) > 1 else pixels
+    return frame
+
+
+def format_element_value(element, max_length=256):
+    """Display text of an element's value; sequences and binary data are summarized rather than stringified"""
+    if element.VR == 'SQ':
+        return f'<{len(element.value)} item(s)>'
+    if isinstance(element.value, (bytes, bytearray)):
+        return f'<{len(element.value)} bytes>'
+    text = str(element.value)
+    return text if len(text) <= max_length else text[:max_length] + '...'
+
+
+class TagNode:
+    """A row of the tag tree: an element of a dataset, or an item of a sequence when tag is None"""
+
+    def __init__(self, parent, row, dataset, tag=None):
+        self.parent, self.row, self.dataset, self.tag = parent, row, dataset, tag
+        self.children, self.columns = None, None
+
+    def element(self):
+        return self.dataset[self.tag]
+
+    def child_nodes(self):
+        # Built on first expansion; a sequence item lists its tags without converting their values
+        if self.children is None:
+            if self.tag is None:
+                self.children = [TagNode(self, row, self.dataset, tag) for row, tag in enumerate(self.dataset.keys())]
+            elif self.element().VR == 'SQ':
+                self.children = [TagNode(self, row, item) for row, item in enumerate(self.element().value)]
+            else:
+                self.children = []
+        return self.children
+
+    def has_children(self):
+        if self.children is not None:
+            return bool(self.children)
+        return self.tag is None or (self.element().VR == 'SQ' and len(self.element().value) > 0)
+
+    def name(self):
+        # Dictionary names avoid converting the element; private tags need the element's own name
+        try:
+            return pydicom.datadict.dictionary_description(self.tag)
+        except KeyError:
+            return self.element().name
+
+    def column_text(self):
+        """(tag, name, VR, value) strings, formatted the first time the row is painted"""
+        if self.columns is None:
+            if self.tag is None:
+                self.columns = ('', f'Item {self.row + 1}', '', '')
+            else:
+                element = self.element()
+                self.columns = (str(element.tag), self.name(), str(element.VR), format_element_value(element))
+        return self.columns
+
+
+class DicomTagModel(QAbstractItemModel):
+    """Tree model over a dataset's elements, with nested sequences expanded on demand"""
+    HEADERS = ('Tag', 'Name', 'VR', 'Value')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = None
+
+    def set_dataset(self, dataset):
+        self.beginResetModel()
+        self.root = TagNode(None, 0, dataset) if dataset is not None else None
+        self.endResetModel()
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if node is None or not 0 <= row < len(node.child_nodes()):
+            return QModelIndex()
+        return self.createIndex(row, column, node.child_nodes()[row])
+
+    def parent(self, index):
+        node = index.internalPointer() if index.isValid() else None
+        if node is None or node.parent is self.root:
+            return QModelIndex()
+        return self.createIndex(node.parent.row, 0, node.parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        return len(node.child_nodes()) if node is not None else 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.HEADERS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        return node is not None and parent.column() <= 0 and node.has_children()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.column_text()[index.column()]
+        if role == Qt.UserRole:  # (name, keyword) for filtering, without formatting the value
+            if node.tag is None:
+                return '', ''
+            return node.name(), pydicom.datadict.keyword_for_tag(node.tag)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class TagFilterProxyModel(QSortFilterProxyModel):
+    """Filters top-level elements by a substring of their name or keyword, or by a set of exact keywords.
+
+    Rows inside sequences are always accepted, so filtering never expands (and formats) nested datasets.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text, self.keywords = '', None
+
+    def set_text(self, text):
+        self.text, self.keywords = text.lower(), None
+        self.invalidateFilter()
+
+    def set_keywords(self, keywords):
+        self.text, self.keywords = '', set(keywords)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if source_parent.isValid():
+            return True
+        if self.keywords is None and not self.text:
+            return True
+        model = self.sourceModel()
+        name, keyword = model.data(model.index(source_row, 1, source_parent), Qt.UserRole)
+        if self.keywords is not None:
+            return keyword in self.keywords
+        return self.text in name.lower() or self.text in keyword.lower()
+
+
+class DicomLoaderThread(QThread):
+    """Read a list of DICOM files across a process pool without blocking the GUI thread.
+
+    dcmread parses in pure Python under the GIL, so only separate processes scale it with the number of cores.
+    Workers are spawned, since forking a process with running Qt threads can deadlock it.
+    """
+    progress = pyqtSignal(int, int)
+    loaded = pyqtSignal(list, list)  # [(file_path, dataset)] in input order, [(file_path, error)]
+
+    def __init__(self, file_paths, headers_only=False, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.file_paths = list(file_paths)
+        self.headers_only = headers_only
+        self.max_workers = max_workers or os.cpu_count()
+
+    def run(self):
+        datasets, failures = [None] * len(self.file_paths), []
+        spawn = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=spawn) as executor:
+            futures = {executor.submit(pydicom.dcmread, file_path, stop_before_pixels=self.headers_only): index
+                       for index, file_path in enumerate(self.file_paths)}
+            for done, future in enumerate(as_completed(futures), 1):
+                if self.isInterruptionRequested():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return
+                index = futures[future]
+                try:
+                    datasets[index] = future.result()
+                except Exception as e:
+                    failures.append((self.file_paths[index], str(e)))
+                self.progress.emit(done, len(self.file_paths))
+
+        results = [(file_path, dataset) for file_path, dataset in zip(self.file_paths, datasets) if dataset is not None]
+        self.loaded.emit(results, failures)
+
+
+class TagIndex:
+    """Inverted index from tag keywords to lower-cased values to the indices of the files holding them"""
+
+    def __init__(self):
+        self.postings = {}  # keyword -> {value -> [file index]}
+        self.names = {}  # lower-cased keyword or name -> keyword
+
+    def add(self, file_index, dataset):
+        for element in dataset:
+            if element.VR == 'SQ' or isinstance(element.value, (bytes, bytearray)):
+                continue
+            keyword = element.keyword or str(element.tag)
+            self.names.setdefault(keyword.lower(), keyword)
+            self.names.setdefault(element.name.lower(), keyword)
+            self.postings.setdefault(keyword, {}).setdefault(str(element.value).lower(), []).append(file_index)
+
+    def keywords_for(self, key):
+        key = key.lower()
+        if key in self.names:
+            return {self.names[key]}
+        return {keyword for name, keyword in self.names.items() if key in name}
+
+    def search(self, key, value, exact=False):
+        """Indices of files with a value of the tags matching key (all tags when empty) equal to or containing value"""
+        value, matches = value.lower(), set()
+        for keyword in (self.keywords_for(key) if key else self.postings):
+            for text, file_indices in self.postings.get(keyword, {}).items():
+                if text == value if exact else value in text:
+                    matches.update(file_indices)
+        return matches
+
+
+def parse_tag_query(text):
+    """Split 'Keyword=value' (exact) or 'Keyword: value' (substring) into (key, value, exact); plain text is any tag"""
+    for separator, exact in (('=', True), (':', False)):
+        if separator in text:
+            key, value = text.split(separator, 1)
+            return key.strip(), value.strip(), exact
+    return '', text.strip(), False
+
+
+class TagIndexBuilder(QThread):
+    """Index the tags of loaded datasets in the background; datasets from a folder hold only their headers"""
+    built = pyqtSignal(object, int)  # TagIndex, generation it was built for
+
+    def __init__(self, datasets, generation, parent=None):
+        super().__init__(parent)
+        self.datasets, self.generation = list(datasets), generation
+
+    def run(self):
+        index = TagIndex()
+        for file_index, dataset in enumerate(self.datasets):
+            if self.isInterruptionRequested():
+                return
+            index.add(file_index, dataset)
+        self.built.emit(index, self.generation)
+
+
+# Action per keyword: 'pseudonym' (keyed hash), 'empty', 'remove' or 'keep'. Instance UIDs are remapped unless kept.
+DEFAULT_ANONYMIZATION_PROFILE = {
+    'PatientName': 'pseudonym', 'PatientID': 'pseudonym', 'AccessionNumber': 'pseudonym',
+    'PatientBirthDate': 'empty', 'PatientSex': 'empty', 'ReferringPhysicianName': 'empty',
+    'PerformingPhysicianName': 'empty', 'OperatorsName': 'empty', 'InstitutionName': 'remove',
+    'InstitutionAddress': 'remove', 'PatientAddress': 'remove', 'OtherPatientIDs': 'remove',
+    'OtherPatientNames': 'remove', 'PatientTelephoneNumbers': 'remove', 'PrivateTags': 'remove',
+}
+
+
+# Study, series, instance and frame of reference UIDs, plus every Referenced*InstanceUID, are remapped; class and
+# coding scheme UIDs, including vendor ones, are kept
+REMAPPED_UIDS = {'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'FrameOfReferenceUID',
+                 'ReferencedFrameOfReferenceUID'}
+
+# Maximum value length of the VRs that pseudonyms are written to
+VR_MAX_LENGTHS = {'AE': 16, 'CS': 16, 'SH': 16, 'LO': 64, 'PN': 64}
+
+
+def is_instance_uid(keyword):
+    return keyword in REMAPPED_UIDS or (keyword.startswith('Referenced') and keyword.endswith('InstanceUID'))
+
+
+def load_anonymization_profile(file_path):
+    """Read a profile of {keyword: action} from JSON, on top of the default profile"""
+    with open(file_path) as f:
+        return {**DEFAULT_ANONYMIZATION_PROFILE, **json.load(f)}
+
+
+class Anonymizer:
+    """Applies a tag profile with pseudonyms and UIDs derived from a secret key, so they repeat across files and runs"""
+
+    def __init__(self, key, prefix='ANON', profile=None):
+        self.key, self.prefix = key.encode(), prefix
+        self.profile = profile or DEFAULT_ANONYMIZATION_PROFILE
+
+    def pseudonym(self, value, max_length=64):
+        """Prefix plus a keyed hash of value; the prefix is shortened to keep 12 hash characters within max_length"""
+        digest = hmac.new(self.key, str(value).encode(), hashlib.sha256).hexdigest()[:min(12, max_length)].upper()
+        return self.prefix[:max_length - len(digest)] + digest
+
+    def remap_uid(self, uid):
+        return pydicom.uid.generate_uid(entropy_srcs=[self.key.decode(), str(uid)])
+
+    def anonymize(self, dataset):
+        """Anonymize a dataset in place, including nested sequences; returns the number of elements changed"""
+        changed = 0
+
+        def apply(item, element):
+            nonlocal changed
+            action = self.profile.get(element.keyword)
+            if action == 'keep':
+                return
+            if action == 'remove':
+                del item[element.tag]
+            elif action == 'empty':
+                element.value = ''
+            elif action == 'pseudonym':
+                element.value = self.pseudonym(element.value, VR_MAX_LENGTHS.get(element.VR, 64))
+            elif element.VR == 'UI' and element.value and is_instance_uid(element.keyword):
+                element.value = self.remap_uid(element.value)
+            else:
+                return
+            changed += 1
+
+        if self.profile.get('PrivateTags') == 'remove':
+            dataset.remove_private_tags()
+        dataset.walk(apply)
+        file_meta = getattr(dataset, 'file_meta', None)
+        if file_meta is not None and 'MediaStorageSOPInstanceUID' in file_meta:
+            file_meta.MediaStorageSOPInstanceUID = self.remap_uid(file_meta.MediaStorageSOPInstanceUID)
+        return changed
+
+
+def anonymize_file(anonymizer, source_path, output_path, dry_run=False):
+    """Anonymize one file without decoding its pixels; large values are only read from the source when written"""
+    dataset = pydicom.dcmread(source_path, defer_size='1 MB')
+    changed = anonymizer.anonymize(dataset)
+    if not dry_run:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        dataset.save_as(output_path)
+    return changed
+
+
+class BatchAnonymizerThread(QThread):
+    """Anonymize a folder tree into another across a thread pool, mirroring its layout"""
+    progress = pyqtSignal(int, int)
+    completed = pyqtSignal(int, int, float, float, list)  # files, elements changed, seconds, MB, [(path, error)]
+
+    def __init__(self, anonymizer, input_folder, output_folder, dry_run=False, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.anonymizer, self.dry_run = anonymizer, dry_run
+        self.input_folder, self.output_folder = input_folder, output_folder
+        self.max_workers = max_workers or os.cpu_count()
+
+    def run(self):
+        start = time.perf_counter()
+        file_paths = [os.path.join(root, name) for root, _, names in os.walk(self.input_folder)
+                      for name in names if name.lower().endswith('.dcm')]
+        done, changed, total_bytes, failures = 0, 0, 0, []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(anonymize_file, self.anonymizer, file_path,
+                                       os.path.join(self.output_folder, os.path.relpath(file_path, self.input_folder)),
+                                       self.dry_run): file_path
+                       for file_path in file_paths}
+            for future in as_completed(futures):
+                if self.isInterruptionRequested():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                try:
+                    changed += future.result()
+                    total_bytes += os.path.getsize(futures[future])
+                    done += 1
+                except Exception as e:
+                    failures.append((futures[future], str(e)))
+                self.progress.emit(done + len(failures), len(file_paths))
+        self.completed.emit(done, changed, time.perf_counter() - start, total_bytes / 2 ** 20, failures)
+
+
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'dicom_viewer', 'thumbnails')
+
+
+def make_thumbnail(file_path, size=128):
+    """Downsampled uint8 image of a file's first frame: (height, width) grayscale or (height, width, 3) RGB"""
+    dataset = pydicom.dcmread(file_path, defer_size='4 MB')
+    pixels = decode_frame(file_path, dataset, 0)
+    step = max(1, -(-max(pixels.shape[:2]) // size))
+    pixels = pixels[::step, ::step]
+    if pixels.dtype == np.uint8 and pixels.ndim == 3:
+        return np.ascontiguousarray(pixels)
+    low, high = float(pixels.min()), float(pixels.max())
+    return ((pixels - low) * (255 / max(high - low, 1e-6))).astype(np.uint8)
+
+
+def cached_thumbnail(file_path, size=128, cache_dir=THUMBNAIL_CACHE_DIR):
+    """Thumbnail from the on-disk cache, keyed on the file's path, size and mtime, creating it on a miss"""
+    stat = os.stat(file_path)
+    key = hashlib.sha1(repr((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, size)).encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, key + '.npy')
+    try:
+        return np.load(cache_path)
+    except (OSError, ValueError):
+        pass
+    thumbnail = make_thumbnail(file_path, size)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + '.tmp', 'wb') as f:
+            np.save(f, thumbnail)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError:
+        pass  # A read-only cache only costs regenerating the thumbnail next time
+    return thumbnail
+
+
+def to_qimage(image):
+    """Copy a uint8 grayscale or RGB array into a QImage, which unlike QPixmap can be built off the GUI thread"""
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    if image.ndim == 3:
+        return QImage(image.data, width, height, 3 * width, QImage.Format_RGB888).copy()
+    return QImage(image.data, width, height, width, QImage.Format_Grayscale8).copy()
+
+
+class ThumbnailModel(QAbstractListModel):
+    """Thumbnails of a list of files, generated in the background only for the rows a view asks to paint"""
+    thumbnail_ready = pyqtSignal(int, int, object)  # generation, row, QImage or None
+
+    def __init__(self, size=128, max_images=4096, parent=None):
+        super().__init__(parent)
+        self.size, self.max_images = size, max_images
+        self.paths, self.generation = [], 0
+        self.images, self.pending = OrderedDict(), set()
+        self.executor = ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 2) // 2))
+        self.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.generation += 1  # Thumbnails still being made for the previous files are dropped
+        self.paths = list(paths)
+        self.images.clear()
+        self.pending.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return f'Image {row + 1}'
+        if role == Qt.ToolTipRole:
+            return self.paths[row]
+        if role == Qt.DecorationRole:
+            if row not in self.images:
+                self.request(row)
+                return None
+            self.images.move_to_end(row)
+            image = self.images[row]
+            return image if not image.isNull() else None
+        return None
+
+    def request(self, row):
+        if row not in self.pending:
+            self.pending.add(row)
+            self.executor.submit(self.load_thumbnail, self.generation, row, self.paths[row])
+
+    def load_thumbnail(self, generation, row, file_path):
+        if generation != self.generation:
+            return
+        try:
+            image = to_qimage(cached_thumbnail(file_path, self.size))
+        except Exception:
+            image = None
+        self.thumbnail_ready.emit(generation, row, image)
+
+    def on_thumbnail_ready(self, generation, row, image):
+        if generation != self.generation:
+            return
+        self.pending.discard(row)
+        self.images[row] = image if image is not None else QImage()  # A null image marks an unreadable file
+        while len(self.images) > self.max_images:
+            self.images.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class SliceCache:
+    """Thread-safe LRU cache of display-ready slices, bounded by the total bytes it holds"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._slices
+
+    def get(self, key):
+        with self._lock:
+            image = self._slices.get(key)
+            if image is not None:
+                self._slices.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            if key in self._slices:
+                self.current_bytes -= self._slices.pop(key).nbytes
+            self._slices[key] = image
+            self.current_bytes += image.nbytes
+            # Evict least recently used slices, always keeping the one just added
+            while self.current_bytes > self.max_bytes and len(self._slices) > 1:
+                _, evicted = self._slices.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self.current_bytes = 0
+
 
 class EnhancedDicomViewer(QMainWindow):
+    PREFETCH_DEPTH = 8  # Slices decoded ahead of the scroll direction
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle('Advanced DICOM Viewer - M@D Edition')
@@ -28,13 +597,42 @@ class EnhancedDicomViewer(QMainWindow):
         # Instance variables
         self.setup_ui()
         self.dicom_files = []
+        self.dicom_paths = []  # File path for each entry in dicom_files
         self.current_index = -1  # Track the current DICOM file index
         self.pixel_array = None
+        self.pixel_dataset = None  # Dataset whose rescale tags apply to pixel_array
+        self.loader_thread = None
+        self.anonymizer_thread = None
+
+        # Tag index over every loaded file, rebuilt in the background whenever files are added
+        self.tag_index, self.index_builder, self.index_generation = None, None, 0
+
+        # Window/level in modality units, applied through lookup tables cached per rescale and window
+        self.window_center, self.window_width = None, None
+        self.window_drag = None
+        self.modality_tables, self.window_luts = {}, {}
+
+        # Decoded single-frame slices, filled ahead of scrolling by a background worker
+        self.slice_cache = SliceCache()
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=2)
+        self.prefetch_pending = set()
+        self.prefetch_lock = threading.Lock()
+        self.cache_generation = 0
+
+        # Frames of the current multi-frame file, decoded as they are shown; frame_count is 0 for single frames
+        self.frame_cache = SliceCache(max_bytes=128 * 1024 * 1024)
+        self.frame_count = 0
 
         # Timer for cine mode
         self.cine_timer = QTimer()
         self.cine_timer.timeout.connect(self.update_cine_image)
 
+        # Tags are only rebuilt once scrubbing or cine playback pauses on a slice
+        self.current_dicom = None
+        self.tags_timer = QTimer()
+        self.tags_timer.setSingleShot(True)
+        self.tags_timer.timeout.connect(self.load_current_dataset)
+
     def setup_ui(self):
         # Central widget and main layout
         central_widget = QWidget()
@@ -57,8 +655,18 @@ class EnhancedDicomViewer(QMainWindow):
         self.file_list_widget = self.create_file_list_widget()
         self.viewer_widget = self.create_viewer_widget()
 
+        # Filter box above the file list, answered from the tag index of all loaded files
+        file_panel = QWidget()
+        file_panel_layout = QVBoxLayout()
+        file_panel_layout.setContentsMargins(0, 0, 0, 0)
+        file_panel.setLayout(file_panel_layout)
+        self.file_filter_input = QLineEdit(placeholderText='Filter files (e.g. SeriesDescription: T1, Modality=MR)')
+        self.file_filter_input.textChanged.connect(self.filter_files)
+        file_panel_layout.addWidget(self.file_filter_input)
+        file_panel_layout.addWidget(self.file_list_widget)
+
         # Add splitter to main layout
-        self.main_splitter.addWidget(self.file_list_widget)
+        self.main_splitter.addWidget(file_panel)
         self.main_splitter.addWidget(self.viewer_widget)
         main_layout.addWidget(self.main_splitter)
 
@@ -90,8 +698,11 @@ class EnhancedDicomViewer(QMainWindow):
         self.image_tab = self.create_image_tab()
         self.tags_tab = self.create_tags_tab()
 
+        self.tiles_tab = self.create_tiles_tab()
+
         self.tab_widget.addTab(self.image_tab, "Image")
         self.tab_widget.addTab(self.tags_tab, "DICOM Tags")
+        self.tab_widget.addTab(self.tiles_tab, "Tiles")
         viewer_layout.addWidget(self.tab_widget)
 
         return viewer_widget
@@ -105,6 +716,10 @@ class EnhancedDicomViewer(QMainWindow):
         anonymize_button.clicked.connect(self.anonymize_dicom)
         layout.addWidget(anonymize_button)
 
+        batch_anonymize_button = QPushButton('Batch Anonymize Folder')
+        batch_anonymize_button.clicked.connect(self.batch_anonymize)
+        layout.addWidget(batch_anonymize_button)
+
     def create_image_tab(self):
         image_tab = QWidget()
         image_layout = QVBoxLayout()
@@ -113,8 +728,12 @@ class EnhancedDicomViewer(QMainWindow):
         self.image_label = QLabel()
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.setFixedSize(800, 600)  # Fixed size for consistent display dimensions
+        self.image_label.installEventFilter(self)  # Mouse drag adjusts window/level
         image_layout.addWidget(self.image_label)
 
+        self.window_label = QLabel()
+        image_layout.addWidget(self.window_label)
+
         # Create Slider to scroll through images
         self.slice_slider = QSlider(Qt.Horizontal)
         self.slice_slider.setFixedHeight(20)
@@ -142,9 +761,15 @@ class EnhancedDicomViewer(QMainWindow):
         search_layout.addWidget(search_button)
         tags_layout.addLayout(search_layout)
 
-        self.tags_table = QTableWidget(columnCount=3)
-        self.tags_table.setHorizontalHeaderLabels(['Tag', 'VR', 'Value'])
-        tags_layout.addWidget(self.tags_table)
+        # Values are formatted only for rows that are painted; sequences expand as a tree
+        self.tag_model = DicomTagModel(self)
+        self.tag_filter = TagFilterProxyModel(self)
+        self.tag_filter.setSourceModel(self.tag_model)
+        self.tags_view = QTreeView()
+        self.tags_view.setModel(self.tag_filter)
+        self.tags_view.setUniformRowHeights(True)
+        self.tags_view.setAlternatingRowColors(True)
+        tags_layout.addWidget(self.tags_view)
 
         group_layout = QHBoxLayout()
         groups = ['Patient', 'Study', 'Modality', 'Physician', 'Image']
@@ -156,6 +781,28 @@ class EnhancedDicomViewer(QMainWindow):
 
         return tags_tab
 
+    def create_tiles_tab(self):
+        # Icon-mode list view paints only the visible tiles; thumbnails arrive from the model's background workers
+        self.thumbnail_model = ThumbnailModel(parent=self)
+        tiles_view = QListView()
+        tiles_view.setViewMode(QListView.IconMode)
+        tiles_view.setResizeMode(QListView.Adjust)
+        tiles_view.setMovement(QListView.Static)
+        tiles_view.setUniformItemSizes(True)
+        tiles_view.setLayoutMode(QListView.Batched)
+        tiles_view.setIconSize(QSize(self.thumbnail_model.size, self.thumbnail_model.size))
+        tiles_view.setGridSize(QSize(self.thumbnail_model.size + 16, self.thumbnail_model.size + 32))
+        tiles_view.setModel(self.thumbnail_model)
+        tiles_view.clicked.connect(self.show_tile)
+        return tiles_view
+
+    def show_tile(self, index):
+        if not 0 <= index.row() < self.file_list_widget.count():
+            return
+        self.file_list_widget.setCurrentRow(index.row())
+        self.load_selected_dicom(self.file_list_widget.item(index.row()))
+        self.tab_widget.setCurrentWidget(self.image_tab)
+
     def toggle_cine_mode(self, checked):
         if checked:
             self.cine_button.setText("Stop Cine Mode")
@@ -165,11 +812,10 @@ class EnhancedDicomViewer(QMainWindow):
             self.cine_timer.stop()
 
     def update_cine_image(self):
-        if self.dicom_files or self.pixel_array is not None or self.pixel_array.ndim == 3:
-            # Move to the next slice
-            self.current_index = (self.current_index + 1) % self.pixel_array.shape[0]  # Wrap around using modulo
-            self.slice_slider.setValue(self.current_index)
-            self.update_image(self.current_index)  # Display the next slice
+        if self.dicom_files and self.pixel_array is not None:
+            # Move to the next slice or frame; the slider's valueChanged displays it
+            next_value = (self.slice_slider.value() + 1) % (self.slice_slider.maximum() + 1)  # Wrap around using modulo
+            self.slice_slider.setValue(next_value)
 
     def upload_dicom_files(self):
         file_dialog = QMessageBox.question(
@@ -189,25 +835,56 @@ class EnhancedDicomViewer(QMainWindow):
                 self.load_dicom_files_from_folder(folder_path)
 
     def load_dicom_files_from_folder(self, folder_path):
+        # Checked before clearing, or the running loader would append its files to the emptied lists
+        if self.loader_thread is not None and self.loader_thread.isRunning():
+            QMessageBox.warning(self, 'Warning', 'Files are still loading.')
+            return
         self.dicom_files.clear()
+        self.dicom_paths.clear()
         self.file_list_widget.clear()
+        self.reset_slice_cache()
+        self.index_generation += 1  # Drops an index still being built for the previous folder
+        self.tag_index = None
+        self.thumbnail_model.set_paths(self.dicom_paths)
 
         file_paths = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith('.dcm')]
         file_paths.sort()
 
-        self.process_file_paths(file_paths)
+        # Only index the headers of a folder; pixel data is read when a slice is shown
+        self.process_file_paths(file_paths, headers_only=True)
     
-    def process_file_paths(self, file_paths):
-        for file_path in file_paths:
-            try:
-                dicom_data = pydicom.dcmread(file_path)
-                self.dicom_files.append(dicom_data)
-                patient_name = dicom_data.get('PatientName', 'Unknown')
-                study_desc = dicom_data.get('StudyDescription', 'No Description')
-                list_item = f"{patient_name} - {study_desc}"
-                self.file_list_widget.addItem(list_item)
-            except Exception as e:
-                QMessageBox.warning(self, 'Warning', f'Failed to load {file_path}: {str(e)}')
+    def process_file_paths(self, file_paths, headers_only=False):
+        if self.loader_thread is not None and self.loader_thread.isRunning():
+            QMessageBox.warning(self, 'Warning', 'Files are still loading.')
+            return
+
+        # Files are read in the background; the progress dialog's Cancel stops the loader
+        progress_dialog = QProgressDialog('Loading DICOM files...', 'Cancel', 0, len(file_paths), self)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+
+        self.loader_thread = DicomLoaderThread(file_paths, headers_only, parent=self)
+        self.loader_thread.progress.connect(lambda done, total: progress_dialog.setValue(done))
+        self.loader_thread.loaded.connect(self.add_loaded_files)
+        self.loader_thread.finished.connect(progress_dialog.close)
+        progress_dialog.canceled.connect(self.loader_thread.requestInterruption)
+        self.loader_thread.start()
+
+    def add_loaded_files(self, results, failures):
+        for file_path, dicom_data in results:
+            self.dicom_files.append(dicom_data)
+            self.dicom_paths.append(file_path)
+            patient_name = dicom_data.get('PatientName', 'Unknown')
+            study_desc = dicom_data.get('StudyDescription', 'No Description')
+            list_item = f"{patient_name} - {study_desc}"
+            self.file_list_widget.addItem(list_item)
+
+        if failures:
+            details = '\n'.join(f'{file_path}: {error}' for file_path, error in failures[:20])
+            QMessageBox.warning(self, 'Warning', f'Failed to load {len(failures)} file(s):\n{details}')
+
+        self.build_tag_index()
+        self.thumbnail_model.set_paths(self.dicom_paths)
 
         if self.dicom_files:
             self.file_list_widget.setCurrentRow(0)
@@ -218,135 +895,283 @@ class EnhancedDicomViewer(QMainWindow):
             self.slice_slider.setEnabled(True)
             self.cine_button.setEnabled(True)
 
+    def build_tag_index(self):
+        # A newer generation makes a builder still running for an older file list emit into the void
+        self.index_generation += 1
+        self.tag_index = None
+        if self.index_builder is not None and self.index_builder.isRunning():
+            self.index_builder.requestInterruption()
+        self.index_builder = TagIndexBuilder(self.dicom_files, self.index_generation, parent=self)
+        self.index_builder.built.connect(self.on_tag_index_built)
+        self.index_builder.start()
+
+    def on_tag_index_built(self, index, generation):
+        if generation == self.index_generation:
+            self.tag_index = index
+            self.filter_files()
+
+    def filter_files(self):
+        """Hide the files that do not match the filter box's query"""
+        text = self.file_filter_input.text().strip()
+        if not text:
+            matches = None
+        elif self.tag_index is None:
+            self.statusBar().showMessage('Indexing tags...')
+            return  # Applied once the index is built
+        else:
+            matches = self.tag_index.search(*parse_tag_query(text))
+        for row in range(self.file_list_widget.count()):
+            self.file_list_widget.item(row).setHidden(matches is not None and row not in matches)
+        if matches is not None:
+            self.statusBar().showMessage(f'{len(matches)} of {self.file_list_widget.count()} files match')
+        else:
+            self.statusBar().clearMessage()
+
     def load_selected_dicom(self, item):
         index = self.file_list_widget.row(item)
         self.current_index = index  # Set the current index based on selection
-        self.current_dicom = self.dicom_files[index]
+        self.tags_timer.stop()
+        self.current_dicom = self.read_pixel_dataset(index)
+        self.window_center, self.window_width = None, None  # Take the window of the newly selected file
         self.process_dicom_images()
         self.populate_tags_table()
 
+    def load_current_dataset(self):
+        """Make the slice shown from the cache the current dataset and refresh its tags"""
+        self.tags_timer.stop()
+        if 0 <= self.current_index < len(self.dicom_files):
+            self.current_dicom = self.read_pixel_dataset(self.current_index)
+            self.populate_tags_table()
+
+    def reset_slice_cache(self):
+        # Bumping the generation discards prefetches still running for the previous file list
+        self.cache_generation += 1
+        self.slice_cache.clear()
+        self.frame_cache.clear()
+        with self.prefetch_lock:
+            self.prefetch_pending.clear()
+
+    def render_slice(self, index):
+        """Decode the stored pixels of a single-frame file, or return None for other pixel layouts"""
+        header = self.dicom_files[index]
+        if int(header.get('NumberOfFrames', 1) or 1) > 1 or int(header.get('SamplesPerPixel', 1)) > 1:
+            return None
+        try:
+            pixels = self.read_pixel_dataset(index).pixel_array
+        except Exception:
+            return None
+        return pixels if pixels.ndim == 2 else None
+
+    def prefetch_slice(self, index, generation):
+        try:
+            image = self.render_slice(index)
+            if image is not None and generation == self.cache_generation:
+                self.slice_cache.put(index, image)
+        finally:
+            with self.prefetch_lock:
+                self.prefetch_pending.discard((generation, index))
+
+    def prefetch_slices(self, index, direction):
+        generation = self.cache_generation
+        for step in range(1, self.PREFETCH_DEPTH + 1):
+            neighbour = index + step * direction
+            if not 0 <= neighbour < len(self.dicom_files):
+                break
+            with self.prefetch_lock:
+                if neighbour in self.slice_cache or (generation, neighbour) in self.prefetch_pending:
+                    continue
+                self.prefetch_pending.add((generation, neighbour))
+            self.prefetch_executor.submit(self.prefetch_slice, neighbour, generation)
+
+    def show_cached_slice(self, index):
+        direction = 1 if index >= self.current_index else -1
+        image = self.slice_cache.get(index)
+        if image is None:
+            image = self.render_slice(index)
+            if image is None:
+                # Multi-frame or color file: take the full loading path
+                self.load_selected_dicom(self.file_list_widget.item(index))
+                return
+            self.slice_cache.put(index, image)
+
+        self.current_index = index
+        self.frame_count = 0
+        self.pixel_array = image
+        self.pixel_dataset = self.dicom_files[index]
+        self.display_image()
+        self.file_list_widget.setCurrentRow(index)
+        self.prefetch_slices(index, direction)
+        self.tags_timer.start(200)
+
+    def read_pixel_dataset(self, index):
+        """Return the dataset at index, reading it again with pixel data if only its header was indexed"""
+        dicom_data = self.dicom_files[index]
+        if 'PixelData' not in dicom_data:
+            # Large pixel data is only read if it is accessed, not when frames are decoded from the file
+            dicom_data = pydicom.dcmread(self.dicom_paths[index], defer_size='4 MB')
+        return dicom_data
+
+    def get_frame(self, index):
+        """Decode a frame of the current file through the frame cache; color frames stay RGB"""
+        key = (self.current_index, index)
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            frame = decode_frame(self.dicom_paths[self.current_index], self.current_dicom, index)
+            if frame.ndim == 3 and frame.dtype != np.uint8:
+                frame = (frame >> max(int(self.current_dicom.get('BitsStored', 16)) - 8, 0)).astype(np.uint8)
+            self.frame_cache.put(key, frame)
+        return frame
+
     def process_dicom_images(self):
-        self.pixel_array = self.current_dicom.pixel_array
-        
-        # Handle the pixel array shape properly
-        if self.pixel_array.ndim == 4 and self.pixel_array.shape[3] == 3:
-            self.pixel_array = np.mean(self.pixel_array, axis=-1).astype(np.uint8)
+        frames = int(self.current_dicom.get('NumberOfFrames', 1) or 1)
+        self.frame_count = frames if frames > 1 else 0
+        self.pixel_array = self.get_frame(0)
 
-        # Normalize if not already uint8
-        if self.pixel_array.dtype != np.uint8:
-            self.pixel_array = self.normalize_image(self.pixel_array)
+        self.pixel_dataset = self.current_dicom
+        if self.window_center is None:
+            self.reset_window(self.current_dicom, self.pixel_array)
 
-        if self.pixel_array.ndim == 2:
-            self.display_image()
-        elif self.pixel_array.ndim == 3:
+        if self.frame_count:
             self.display_m2d_images()
         else:
-            QMessageBox.warning(self, 'Unsupported DICOM', 'Unsupported DICOM file format.')
+            # The slider scrolls through files again after a multi-frame file
+            self.slice_slider.blockSignals(True)
+            self.slice_slider.setRange(0, len(self.dicom_files) - 1)
+            self.slice_slider.setValue(self.current_index)
+            self.slice_slider.blockSignals(False)
+            self.display_image()
+
+    def display_frame(self, frame):
+        return frame if frame.ndim == 3 else self.apply_window(frame)
 
     def display_image(self):
-        height, width = self.pixel_array.shape
-        q_image = QImage(self.pixel_array.data, width, height, width, QImage.Format_Grayscale8)
+        self.show_pixmap(self.display_frame(self.pixel_array))
+        self.slice_slider.setVisible(True)
+
+    def show_pixmap(self, image):
+        height, width = image.shape[:2]
+        if image.ndim == 3:
+            image = np.ascontiguousarray(image)
+            q_image = QImage(image.data, width, height, 3 * width, QImage.Format_RGB888)
+        else:
+            q_image = QImage(image.data, width, height, width, QImage.Format_Grayscale8)
         pixmap = QPixmap.fromImage(q_image)
         self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
-        self.slice_slider.setVisible(True)
+
+    def get_rescale(self, dataset):
+        slope = float(dataset.get('RescaleSlope', 1) or 1) if dataset is not None else 1.0
+        intercept = float(dataset.get('RescaleIntercept', 0) or 0) if dataset is not None else 0.0
+        return slope, intercept
+
+    def reset_window(self, dataset, pixels):
+        """Take the window from WindowCenter/WindowWidth, or span the pixel range of the first slice shown"""
+        center, width = dataset.get('WindowCenter'), dataset.get('WindowWidth')
+        if center is not None and width is not None:
+            # Multi-valued windows list alternatives; use the first one
+            center = center[0] if isinstance(center, pydicom.multival.MultiValue) else center
+            width = width[0] if isinstance(width, pydicom.multival.MultiValue) else width
+            self.window_center, self.window_width = float(center), max(float(width), 1.0)
+        else:
+            slope, intercept = self.get_rescale(dataset)
+            low, high = sorted((float(pixels.min()) * slope + intercept, float(pixels.max()) * slope + intercept))
+            self.window_center, self.window_width = (low + high) / 2, max(high - low, 1.0)
+        self.update_window_label()
+
+    def update_window_label(self):
+        self.window_label.setText(f'W: {self.window_width:.0f}  L: {self.window_center:.0f}')
+
+    def get_window_lut(self, slope, intercept, signed, inverted=False):
+        table_key = (slope, intercept, signed)
+        if table_key not in self.modality_tables:
+            self.modality_tables[table_key] = modality_value_table(slope, intercept, signed)
+        lut_key = table_key + (self.window_center, self.window_width, inverted)
+        if lut_key not in self.window_luts:
+            if len(self.window_luts) > 32:  # Dragging the window creates a table per position
+                self.window_luts.clear()
+            lut = window_lut(self.modality_tables[table_key], self.window_center, self.window_width)
+            self.window_luts[lut_key] = 255 - lut if inverted else lut
+        return self.window_luts[lut_key]
+
+    def apply_window(self, pixels):
+        """Map stored pixel values to a uint8 display image through the current window/level"""
+        if self.window_center is None:
+            self.reset_window(self.pixel_dataset, pixels)
+        slope, intercept = self.get_rescale(self.pixel_dataset)
+        # MONOCHROME1 shows low values as white, e.g. in CR, DX and mammography
+        inverted = (self.pixel_dataset is not None
+                    and self.pixel_dataset.get('PhotometricInterpretation') == 'MONOCHROME1')
+        if pixels.dtype in (np.uint8, np.uint16, np.int16):
+            lut = self.get_window_lut(slope, intercept, pixels.dtype == np.int16, inverted)
+            return np.take(lut, pixels.view(np.uint16) if pixels.dtype == np.int16 else pixels)
+
+        # Other pixel types (e.g. 32-bit or float data) are windowed directly
+        values = pixels.astype(np.float32) * slope + intercept
+        image = window_lut(values, self.window_center, self.window_width)
+        return 255 - image if inverted else image
+
+    def redisplay_image(self):
+        if self.pixel_array is None:
+            return
+        if self.frame_count:
+            self.update_image(self.slice_slider.value())
+        else:
+            self.display_image()
+
+    def eventFilter(self, obj, event):
+        if obj is self.image_label and self.pixel_array is not None and self.window_center is not None:
+            if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+                self.window_drag = (event.pos(), self.window_center, self.window_width)
+                return True
+            if event.type() == QEvent.MouseMove and self.window_drag is not None:
+                # Horizontal drag changes the width, vertical drag the level
+                start_pos, start_center, start_width = self.window_drag
+                delta = event.pos() - start_pos
+                step = start_width / 256
+                self.window_width = max(start_width + delta.x() * step, 1.0)
+                self.window_center = start_center + delta.y() * step
+                self.update_window_label()
+                self.redisplay_image()
+                return True
+            if event.type() == QEvent.MouseButtonRelease and self.window_drag is not None:
+                self.window_drag = None
+                return True
+        return super().eventFilter(obj, event)
 
     def display_m2d_images(self):
-        depth, height, width = self.pixel_array.shape
-        self.slice_slider.setRange(0, depth - 1)
-        self.slice_slider.setValue(0)  # Initialize slider to the first slice
+        self.slice_slider.blockSignals(True)
+        self.slice_slider.setRange(0, self.frame_count - 1)
+        self.slice_slider.setValue(0)  # Initialize slider to the first frame
+        self.slice_slider.blockSignals(False)
         self.slice_slider.setVisible(True)
         self.update_image(0)  # Display the first slice
 
     def display_tiles(self):
-        """Display multiple DICOM files as tiles in a grid layout."""
-        try:
-            if not self.dicom_files:
-                QMessageBox.warning(self, "Error", "No DICOM files loaded.")
-                return
-
-            # Prepare pixel arrays from all DICOM files
-            slices = []
-            for dicom_data in self.dicom_files:
-                if hasattr(dicom_data, 'pixel_array'):
-                    pixel_array = self.normalize_image(dicom_data.pixel_array)
-                    slices.append(pixel_array)
-
-            if not slices:
-                QMessageBox.warning(self, "Error", "No image data found in DICOM files.")
-                return
-
-            # Arrange slices in a grid
-            num_slices = len(slices)
-            num_columns = min(5, num_slices)  # Limit to 5 columns
-            num_rows = (num_slices + num_columns - 1) // num_columns
-
-            fig, axs = plt.subplots(num_rows, num_columns, figsize=(15, num_rows * 3))
-            axs = axs.flatten()  # Flatten axes for easy iteration
-
-            for i, ax in enumerate(axs):
-                if i < num_slices:
-                    ax.imshow(slices[i], cmap='gray', aspect='auto')
-                    ax.axis('off')
-                    ax.set_title(f"Image {i + 1}")
-                else:
-                    ax.axis('off')  # Hide unused axes
-
-            plt.tight_layout()
-            plt.show()
-
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Error displaying tiles: {e}")
-
+        """Show every loaded file as a thumbnail in the Tiles tab"""
+        if not self.dicom_files:
+            QMessageBox.warning(self, "Error", "No DICOM files loaded.")
+            return
+        self.tab_widget.setCurrentWidget(self.tiles_tab)
 
     def update_image(self,value):
-        if self.pixel_array.ndim in [3,4]:
-            current_slice = self.slice_slider.value()
-            # Handle both 3D (many slices) and 4D (if color channels)
-            display_image = self.pixel_array[current_slice] if self.pixel_array.ndim == 3 else self.pixel_array[current_slice, :, :]
-            
-            height, width = display_image.shape
-            q_image = QImage(display_image.data, width, height, width, QImage.Format_Grayscale8)
-            pixmap = QPixmap.fromImage(q_image)
-            self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        if self.frame_count:
+            # Only this frame is decoded; frames already shown come from the frame cache
+            self.pixel_array = self.get_frame(value)
+            self.show_pixmap(self.display_frame(self.pixel_array))
         else:
-            self.current_index = value
-            self.load_selected_dicom(self.file_list_widget.item(self.current_index))
-
-    def normalize_image(self, image):
-        """Normalize the image to 8-bit for display"""
-        image = image.astype(float)
-        image_min = image.min()
-        image_max = image.max()
-        if image_max - image_min > 0:  # Avoid division by zero
-            image = (image - image_min) / (image_max - image_min)  # Normalize to [0, 1]
-        return (image * 255).astype(np.uint8)
+            self.show_cached_slice(value)
 
     def populate_tags_table(self):
-        self.tags_table.setRowCount(0)
-        for elem in self.current_dicom:
-            if elem.VR is not None:
-                self.add_tag_row(str(elem.tag), str(elem.VR), str(elem.value))
-
-    def add_tag_row(self, tag, vr, value):
-        row_position = self.tags_table.rowCount()
-        self.tags_table.insertRow(row_position)
-        self.tags_table.setItem(row_position, 0, QTableWidgetItem(tag))
-        self.tags_table.setItem(row_position, 1, QTableWidgetItem(vr))
-        self.tags_table.setItem(row_position, 2, QTableWidgetItem(value))
+        # The current search or group filter stays applied to the new dataset
+        self.tag_model.set_dataset(self.current_dicom)
 
     def search_dicom_tag(self):
-        tag_name = self.tag_search_input.text().lower()
-        self.tags_table.setRowCount(0)
-
-        if not self.current_dicom:
-            return
-
-        for elem in self.current_dicom:
-            if tag_name in str(elem.name).lower():
-                self.add_tag_row(str(elem.tag), str(elem.VR), str(elem.value))
-                
+        if self.tags_timer.isActive():
+            self.load_current_dataset()
+        self.tag_filter.set_text(self.tag_search_input.text())
 
     def explore_group(self, group_name):
+        if self.tags_timer.isActive():
+            self.load_current_dataset()
         groups = {
             'Patient': ['PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex'],
             'Study': ['StudyInstanceUID', 'StudyDate', 'StudyDescription'],
@@ -355,40 +1180,20 @@ class EnhancedDicomViewer(QMainWindow):
             'Image': ['SliceLocation', 'ImagePosition', 'PixelSpacing']
         }
 
-        self.tags_table.setRowCount(0)
-        if not self.current_dicom:
-            return
-            
-        for tag_name in groups.get(group_name, []):
-            try:
-                elem = self.current_dicom[tag_name]
-                self.add_tag_row(tag_name, str(elem.VR), str(elem.value))
-            except KeyError:
-                continue
+        self.tag_filter.set_keywords(groups.get(group_name, []))
 
     def anonymize_dicom(self):
+        if self.tags_timer.isActive():
+            self.load_current_dataset()
         if not self.current_dicom:
             QMessageBox.warning(self, 'Warning', 'No DICOM file selected.')
             return
 
-        # Prompt for prefix for anonymization
-        prefix, ok = QInputDialog.getText(self, 'Anonymization', 'Enter prefix for anonymized data:')
-        if not ok:
+        anonymizer = self.ask_anonymizer()
+        if anonymizer is None:
             return
-
-        # Tags to anonymize
-        tags_to_anonymize = [
-            'PatientName', 'PatientID', 'PatientBirthDate',
-            'PatientSex', 'ReferringPhysicianName'
-        ]
-
-        for tag in tags_to_anonymize:
-            try:
-                random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-                anonymized_value = f"{prefix}{random_suffix}"
-                self.current_dicom[tag].value = anonymized_value
-            except KeyError:
-                continue
+        anonymizer.anonymize(self.current_dicom)
+        self.populate_tags_table()
 
         save_path, _ = QFileDialog.getSaveFileName(self, 'Save Anonymized DICOM', '', 'DICOM Files (*.dcm)')
         if save_path:
@@ -398,6 +1203,65 @@ class EnhancedDicomViewer(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, 'Error', f'Failed to save anonymized file: {str(e)}')
 
+    def ask_anonymizer(self):
+        """Prompt for the pseudonym prefix and secret key; the same key always gives the same pseudonyms"""
+        prefix, ok = QInputDialog.getText(self, 'Anonymization', 'Enter prefix for anonymized data:')
+        if not ok:
+            return None
+        key, ok = QInputDialog.getText(self, 'Anonymization', 'Enter the project key for pseudonyms:',
+                                       QLineEdit.Password)
+        if not ok or not key:
+            return None
+        return Anonymizer(key, prefix)
+
+    def batch_anonymize(self):
+        input_folder = QFileDialog.getExistingDirectory(self, 'Select Folder to Anonymize', '')
+        if not input_folder:
+            return
+        anonymizer = self.ask_anonymizer()
+        if anonymizer is None:
+            return
+        profile_path, _ = QFileDialog.getOpenFileName(self, 'Tag Profile (Cancel for the default profile)', '',
+                                                      'JSON Files (*.json)')
+        if profile_path:
+            try:
+                anonymizer.profile = load_anonymization_profile(profile_path)
+            except Exception as e:
+                QMessageBox.critical(self, 'Error', f'Failed to read profile: {str(e)}')
+                return
+        answer = QMessageBox.question(self, 'Batch Anonymization',
+                                      'Write anonymized files? Choose No for a dry run that only reports changes.',
+                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.No)
+        if answer == QMessageBox.Cancel:
+            return
+        dry_run = answer == QMessageBox.No
+        output_folder = input_folder
+        if not dry_run:
+            output_folder = QFileDialog.getExistingDirectory(self, 'Select Output Folder', '')
+            if not output_folder or os.path.abspath(output_folder) == os.path.abspath(input_folder):
+                return
+
+        progress_dialog = QProgressDialog('Anonymizing DICOM files...', 'Cancel', 0, 0, self)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        self.anonymizer_thread = BatchAnonymizerThread(anonymizer, input_folder, output_folder, dry_run, parent=self)
+        self.anonymizer_thread.progress.connect(lambda done, total: (progress_dialog.setMaximum(total),
+                                                                     progress_dialog.setValue(done)))
+        self.anonymizer_thread.completed.connect(lambda *report: self.show_anonymization_report(dry_run, *report))
+        self.anonymizer_thread.finished.connect(progress_dialog.close)
+        progress_dialog.canceled.connect(self.anonymizer_thread.requestInterruption)
+        self.anonymizer_thread.start()
+
+    def show_anonymization_report(self, dry_run, files, changed, seconds, megabytes, failures):
+        seconds = max(seconds, 1e-6)
+        message = (f'{"Dry run: " if dry_run else ""}{files} file(s), {changed} element(s) changed in {seconds:.1f} s '
+                   f'({files / seconds:.0f} files/s, {megabytes / seconds:.1f} MB/s)')
+        if failures:
+            details = '\n'.join(f'{file_path}: {error}' for file_path, error in failures[:20])
+            QMessageBox.warning(self, 'Batch Anonymization', f'{message}\nFailed {len(failures)} file(s):\n{details}')
+        else:
+            QMessageBox.information(self, 'Batch Anonymization', message)
+
 
 def main():
     app = QApplication(sys.argv)
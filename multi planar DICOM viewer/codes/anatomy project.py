@@ -1,12 +1,938 @@
 import sys
 import os
+import time
+import collections
+import json
+import hashlib
+import argparse
+import multiprocessing
+import contextlib
+import functools
+import tracemalloc
 import numpy as np
 import vtk
 import nibabel as nib
 import pydicom
-from PyQt5 import QtWidgets, QtCore
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from PyQt5 import QtWidgets, QtCore, QtGui
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 from vtk.util import numpy_support
+try:
+    import resource  # Worker process memory is only reported where getrusage exists
+except ImportError:
+    resource = None
+
+
+ORIENTATIONS = ['Sagittal', 'Coronal', 'Axial']
+
+# Row-major reslice axes per orientation: output x, y and slice normal are the matrix columns. World
+# coordinates run along R, A and S (see VolumeGeometry.world_matrix), so every view shows superior or anterior up
+RESLICE_AXES = (
+    (0, 0, 1, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1),
+    (1, 0, 0, 0, 0, 0, -1, 0, 0, 1, 0, 0, 0, 0, 0, 1),
+    (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1),
+)
+
+
+@functools.lru_cache(maxsize=64)
+def oblique_axes(orientation, tilt):
+    """Reslice axes of an orientation tilted by tilt degrees about its horizontal axis, as a 16-tuple"""
+    angle = np.radians(tilt)
+    rotation = np.array([[1, 0, 0, 0],
+                         [0, np.cos(angle), -np.sin(angle), 0],
+                         [0, np.sin(angle), np.cos(angle), 0],
+                         [0, 0, 0, 1]])
+    return tuple((np.reshape(RESLICE_AXES[orientation], (4, 4)) @ rotation).ravel())
+
+
+class VolumeGeometry:
+    """Voxel spacing of a volume and the affine from voxel indices to patient coordinates in mm.
+
+    frame names the patient axes of the affine: 'RAS' for NIfTI, 'LPS' for DICOM. The viewer keeps volumes in
+    their stored axis order; axes[i] is the volume axis closest to world (RAS) axis i and signs[i] its direction.
+    """
+
+    def __init__(self, spacing=(1.0, 1.0, 1.0), affine=None, frame='RAS'):
+        self.spacing = tuple(float(s) for s in spacing)
+        self.affine = np.diag(self.spacing + (1.0,)) if affine is None else np.asarray(affine, dtype=float)
+        self.frame = frame
+        ornt = nib.orientations.io_orientation(self.ras_affine)
+        self.axes = tuple(int(np.flatnonzero(ornt[:, 0] == i)[0]) for i in range(3))
+        self.signs = tuple(float(ornt[j, 1]) for j in self.axes)
+
+    @classmethod
+    def from_nifti(cls, image):
+        return cls(image.header.get_zooms()[:3], image.affine, 'RAS')
+
+    @classmethod
+    def from_dicom_series(cls, series):
+        # Volume axes are (row, column, slice): rows advance along the column direction cosines and vice versa
+        row_spacing, column_spacing = series.pixel_spacing[:2]
+        affine = np.eye(4)
+        if series.orientation is not None and series.positions[0] is not None:
+            row_direction, column_direction = np.array(series.orientation[:3]), np.array(series.orientation[3:])
+            normal = series.normal if series.normal is not None else np.cross(row_direction, column_direction)
+            affine[:3, 0] = column_direction * row_spacing
+            affine[:3, 1] = row_direction * column_spacing
+            affine[:3, 2] = normal * series.slice_spacing
+            affine[:3, 3] = series.positions[0]
+        else:
+            affine[:3, :3] = np.diag((row_spacing, column_spacing, series.slice_spacing))
+        return cls((row_spacing, column_spacing, series.slice_spacing), affine, 'LPS')
+
+    @property
+    def ras_affine(self):
+        return np.diag((-1.0, -1.0, 1.0, 1.0)) @ self.affine if self.frame == 'LPS' else self.affine
+
+    @property
+    def origin(self):
+        """RAS position of voxel (0, 0, 0)"""
+        return tuple(float(v) for v in self.ras_affine[:3, 3])
+
+    @property
+    def world_matrix(self):
+        """4x4 from image coordinates (voxel index times spacing) to world coordinates.
+
+        Each volume axis is permuted and flipped onto its closest RAS axis; the residual rotation of an oblique
+        acquisition is only kept in the affine used for patient coordinates.
+        """
+        matrix = np.eye(4)
+        matrix[:3, :3] = 0
+        for i, (axis, sign) in enumerate(zip(self.axes, self.signs)):
+            matrix[i, axis] = sign
+        matrix[:3, 3] = self.origin
+        return matrix
+
+    def slice_position(self, orientation, index):
+        """World position along RAS axis orientation of slice index of the volume axis closest to it"""
+        return self.origin[orientation] + self.signs[orientation] * index * self.spacing[self.axes[orientation]]
+
+    def index_to_world(self, index):
+        return (self.world_matrix @ np.append(np.asarray(index, dtype=float) * self.spacing, 1.0))[:3]
+
+    def world_to_index(self, position):
+        return np.linalg.solve(self.world_matrix, np.append(np.asarray(position, dtype=float), 1.0))[:3] / self.spacing
+
+    def index_to_patient(self, index):
+        return (self.affine @ np.append(np.asarray(index, dtype=float), 1.0))[:3]
+
+
+def list_dicom_files(directory):
+    files = [os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith('.dcm')]
+    if not files:
+        raise ValueError("No DICOM files found in the directory.")
+    return files
+
+
+GEOMETRY_TAGS = ['SeriesInstanceUID', 'SeriesDescription', 'ImagePositionPatient', 'ImageOrientationPatient',
+                 'InstanceNumber', 'PixelSpacing', 'Rows', 'Columns']
+
+
+def read_slice_geometry(file_path):
+    """Read only the tags needed to group and order a slice, as a plain dict that is cheap to pickle"""
+    dataset = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=GEOMETRY_TAGS)
+
+    def floats(keyword):
+        value = dataset.get(keyword)
+        return tuple(float(v) for v in value) if value else None
+
+    instance = dataset.get('InstanceNumber')
+    return {'file_path': file_path, 'series_uid': str(dataset.get('SeriesInstanceUID', '')),
+            'description': str(dataset.get('SeriesDescription', '')), 'position': floats('ImagePositionPatient'),
+            'orientation': floats('ImageOrientationPatient'), 'instance': int(instance) if instance else 0,
+            'pixel_spacing': floats('PixelSpacing'), 'rows': dataset.get('Rows'), 'columns': dataset.get('Columns')}
+
+
+def read_pixels(file_path):
+    return pydicom.dcmread(file_path).pixel_array
+
+
+class DicomSeries:
+    """Files of one series ordered along the slice normal, with the geometry read from their headers."""
+
+    def __init__(self, uid, slices):
+        first = slices[0]
+        self.uid, self.description = uid, first['description']
+        self.rows, self.columns = first['rows'], first['columns']
+        self.pixel_spacing = first['pixel_spacing'] or (1.0, 1.0)
+        self.orientation = first['orientation']
+        if self.orientation is not None and all(s['position'] is not None for s in slices):
+            # Project positions onto the normal, so oblique and non-axial acquisitions sort correctly
+            self.normal = np.cross(self.orientation[:3], self.orientation[3:])
+            keys = np.array([np.dot(self.normal, s['position']) for s in slices])
+        else:
+            self.normal = None
+            keys = np.array([s['instance'] for s in slices], dtype=float)
+        order = np.argsort(keys, kind='stable')
+        self.files = [slices[k]['file_path'] for k in order]
+        self.positions = [slices[k]['position'] for k in order]
+        gaps = np.diff(keys[order])
+        self.slice_spacing = float(np.median(gaps)) if self.normal is not None and len(gaps) and np.median(gaps) > 0 \
+            else 1.0
+
+
+def index_dicom_series(headers):
+    """Group slice headers by SeriesInstanceUID, largest series first; headers without pixel data are skipped"""
+    groups = {}
+    for header in headers:
+        if header['rows']:
+            groups.setdefault(header['series_uid'], []).append(header)
+    if not groups:
+        raise ValueError("No DICOM images found in the directory.")
+    return sorted((DicomSeries(uid, slices) for uid, slices in groups.items()), key=lambda s: -len(s.files))
+
+
+def map_files(function, file_paths, on_result, executor=None, progress=None, is_cancelled=None, done=0, total=None):
+    """Run function on each file, in the executor when given, calling on_result(index, result) as results arrive.
+
+    Returns False if is_cancelled() became true before every file was processed.
+    """
+    total = total or len(file_paths)
+    if executor is None:
+        futures = {}
+        results = ((index, function(path)) for index, path in enumerate(file_paths))
+    else:
+        futures = {executor.submit(function, path): index for index, path in enumerate(file_paths)}
+        results = ((futures[future], future.result()) for future in as_completed(futures))
+    for index, result in results:
+        if is_cancelled is not None and is_cancelled():
+            for future in futures:
+                future.cancel()
+            return False
+        on_result(index, result)
+        done += 1
+        if progress is not None:
+            progress(done, total)
+    return True
+
+
+def process_pool(max_workers=None):
+    """Process pool whose workers are spawned, since forking a process with Qt and VTK threads can deadlock them"""
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def load_dicom_directory(directory, progress=None, is_cancelled=None, max_workers=None):
+    """Index a DICOM directory from its headers and decode its largest series into a preallocated volume.
+
+    Returns (volume, series) with slices along the last axis, or None when is_cancelled() becomes true first.
+    Both passes run across a process pool unless max_workers is 1.
+    """
+    files = list_dicom_files(directory)
+    pool = contextlib.nullcontext() if max_workers == 1 else process_pool(max_workers)
+    with pool as executor:
+        headers = [None] * len(files)
+        if not map_files(read_slice_geometry, files, headers.__setitem__, executor, progress, is_cancelled,
+                         total=2 * len(files)):
+            return None
+        series = index_dicom_series(headers)[0]
+
+        first = read_pixels(series.files[0])
+        if first.ndim != 2:
+            raise ValueError("Only single-frame grayscale series can be stacked into a volume.")
+        # Fortran order lets numpy_to_vtk_image hand the buffer to VTK without another copy
+        volume = np.empty(first.shape + (len(series.files),), dtype=first.dtype, order='F')
+        volume[..., 0] = first
+
+        def store(index, pixels):
+            volume[..., index + 1] = pixels
+
+        if not map_files(read_pixels, series.files[1:], store, executor, progress, is_cancelled,
+                         done=len(files) + 1, total=len(files) + len(series.files)):
+            return None
+    return volume, series
+
+
+def open_nifti(file_path):
+    """Open a NIfTI image in its on-disk dtype, memory-mapping it when the file is uncompressed.
+
+    Returns the unscaled voxel array, its (slope, intercept), the display range in stored units and its geometry.
+    """
+    image = nib.load(file_path, mmap=True)
+    proxy = image.dataobj
+    data = proxy.get_unscaled()
+    slope, intercept = float(proxy.slope), float(proxy.inter)
+    cal_min, cal_max = float(image.header['cal_min']), float(image.header['cal_max'])
+    if cal_max > cal_min:
+        scalar_range = tuple(sorted(((cal_min - intercept) / slope, (cal_max - intercept) / slope)))
+    else:
+        scalar_range = estimate_scalar_range(data)
+    return data, (slope, intercept), scalar_range, VolumeGeometry.from_nifti(image)
+
+
+def estimate_scalar_range(data, max_slices=16):
+    """Min/max over evenly spaced slices, so a memory-mapped volume only pages those slices in"""
+    sample = data[..., ::max(1, data.shape[-1] // max_slices)]
+    low, high = float(sample.min()), float(sample.max())
+    return (low, high) if high > low else (low, low + 1)
+
+
+def slice_blocks(data, block_elements=1 << 22):
+    """Slices along the last axis grouped into blocks of about block_elements voxels, as slice objects"""
+    step = max(1, block_elements // max(1, data[..., 0].size))
+    return [slice(k, k + step) for k in range(0, data.shape[-1], step)]
+
+
+def intensity_histogram(data, max_workers=None, bins=4096):
+    """Histogram of a volume accumulated block by block across threads, as (counts, bin edges).
+
+    Integers of up to 16 bits get one bin per value in a single pass; other types need a min/max pass first.
+    """
+    blocks = slice_blocks(data)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        if data.dtype.kind in 'iu' and data.dtype.itemsize <= 2:
+            offset, size = int(np.iinfo(data.dtype).min), 1 << (8 * data.dtype.itemsize)
+            edges = np.arange(size + 1) + (offset - 0.5)
+
+            def count(block):
+                return np.bincount(data[..., block].astype(np.int32).ravel(order='K') - offset, minlength=size)
+        else:
+            ranges = list(executor.map(lambda block: (np.min(data[..., block]), np.max(data[..., block])), blocks))
+            low, high = float(min(r[0] for r in ranges)), float(max(r[1] for r in ranges))
+            edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+
+            def count(block):
+                return np.histogram(data[..., block], bins=edges)[0]
+        counts = sum(executor.map(count, blocks))
+    return counts, edges
+
+
+def histogram_percentiles(counts, edges, low=0.5, high=99.5):
+    """Lower edge of the bin holding the low percentile and upper edge of the bin holding the high one"""
+    cdf = np.cumsum(counts)
+    first, last = np.searchsorted(cdf, (low / 100 * cdf[-1], high / 100 * cdf[-1]))
+    first = min(first, len(counts) - 1)
+    return float(edges[first]), float(edges[min(max(last, first), len(counts) - 1) + 1])
+
+
+def normalize_to_uint16(data, percentiles=(0.5, 99.5), max_workers=None):
+    """Map the percentiles of a volume to 0 and 65535, clipping outliers, into a Fortran-ordered uint16 volume.
+
+    Blocks are converted in parallel straight into the preallocated output, so besides it only one float32
+    block per worker is held, and a memory-mapped input is read once per pass.
+    """
+    output = np.zeros(data.shape, dtype=np.uint16, order='F')
+    counts, edges = intensity_histogram(data, max_workers)
+    if np.count_nonzero(counts) < 2:
+        return output
+    low, high = histogram_percentiles(counts, edges, *percentiles)
+    scale = 65535 / (high - low)
+
+    def convert(block):
+        values = data[..., block].astype(np.float32)
+        values -= low
+        values *= scale
+        np.clip(values, 0, 65535, out=values)
+        output[..., block] = values
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        list(executor.map(convert, slice_blocks(data)))
+    return output
+
+
+def load_volume(file_path, max_workers=None):
+    """Load a NIfTI file or DICOM directory as (stored values, (slope, intercept), display range, geometry)"""
+    if file_path.endswith(('.nii', '.nii.gz')):
+        return open_nifti(file_path)
+    directory = file_path if os.path.isdir(file_path) else os.path.dirname(file_path)
+    volume, series = load_dicom_directory(directory, max_workers=max_workers)
+    volume = volume if volume.dtype == np.uint16 else normalize_to_uint16(volume, max_workers=max_workers)
+    return volume, (1.0, 0.0), (0, 65535), VolumeGeometry.from_dicom_series(series)
+
+
+def load_label_map(file_path, shape):
+    """Read a NIfTI label map as a Fortran-ordered uint8 volume matching shape.
+
+    Labels outside 0-255 are renumbered in sorted order, which keeps up to 256 distinct labels.
+    """
+    labels = np.asanyarray(nib.load(file_path).dataobj)
+    if labels.shape[:3] != tuple(shape[:3]):
+        raise ValueError(f"Label map shape {labels.shape[:3]} does not match the image shape {tuple(shape[:3])}.")
+    labels = labels.reshape(labels.shape[:3])
+    if labels.dtype.kind == 'f':
+        labels = np.rint(labels)
+    if labels.min() < 0 or labels.max() > 255:
+        values, inverse = np.unique(labels, return_inverse=True)
+        if len(values) > 256:
+            raise ValueError("Label maps with more than 256 labels are not supported.")
+        labels = inverse.reshape(labels.shape)
+    return np.asfortranarray(labels, dtype=np.uint8)
+
+
+def label_statistics(labels, spacing):
+    """(label, voxel count, volume in ml) of every label except background, from bincounts over blocks"""
+    counts = sum(np.bincount(labels[..., block].ravel(order='K'), minlength=256) for block in slice_blocks(labels))
+    voxel_ml = float(np.prod(spacing)) / 1000
+    return [(int(label), int(counts[label]), counts[label] * voxel_ml) for label in np.flatnonzero(counts[1:]) + 1]
+
+
+class VolumeCache:
+    """Loaded volumes stored on disk as memory-mappable .npy files with their geometry in a .json beside them.
+
+    Entries are keyed on the absolute path plus the size and mtime of the file, or of every .dcm file in a
+    DICOM directory, so edited studies miss the cache. Least recently opened entries are evicted past max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=8 << 30):
+        self.directory = directory or os.environ.get(
+            'MPR_VIEWER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'mpr_viewer'))
+        self.max_bytes = max_bytes
+
+    def key(self, path):
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            entries = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                             for entry in os.scandir(path) if entry.name.lower().endswith('.dcm'))
+        else:
+            entries = [(os.stat(path).st_size, os.stat(path).st_mtime_ns)]
+        return hashlib.sha1(repr((path, entries)).encode()).hexdigest()
+
+    def paths(self, key):
+        return os.path.join(self.directory, key + '.npy'), os.path.join(self.directory, key + '.json')
+
+    def get(self, path):
+        """Return ((data, rescale, scalar_range, geometry), description) with data memory-mapped, or None"""
+        data_path, meta_path = self.paths(self.key(path))
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            # Copy-on-write keeps the buffer writable for VTK while pages stay shared with the file
+            data = np.load(data_path, mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+        os.utime(meta_path)  # Marks the entry as recently used
+        geometry = VolumeGeometry(meta['spacing'], meta['affine'], meta['frame'])
+        return (data, tuple(meta['rescale']), tuple(meta['scalar_range']), geometry), meta['description']
+
+    def put(self, path, volume, description=''):
+        """Store a (data, rescale, scalar_range, geometry) tuple; returns False if it could not be written"""
+        data, rescale, scalar_range, geometry = volume
+        data_path, meta_path = self.paths(self.key(path))
+        meta = {'source': os.path.abspath(path), 'description': description, 'rescale': list(rescale),
+                'scalar_range': [float(v) for v in scalar_range], 'spacing': list(geometry.spacing),
+                'affine': geometry.affine.tolist(), 'frame': geometry.frame}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written under temporary names and renamed, so a concurrent reader never maps a partial file
+            with open(data_path + '.tmp', 'wb') as f:
+                np.save(f, np.asfortranarray(data))
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(data_path + '.tmp', data_path)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError:
+            for temporary in (data_path + '.tmp', meta_path + '.tmp'):
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                data_path, meta_path = self.paths(name[:-5])
+                size = os.path.getsize(meta_path) + (os.path.getsize(data_path) if os.path.exists(data_path) else 0)
+                entries.append((os.path.getmtime(meta_path), size, data_path, meta_path))
+        total = sum(entry[1] for entry in entries)
+        for _, size, data_path, meta_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(meta_path)
+                if os.path.exists(data_path):
+                    os.remove(data_path)
+            except OSError:
+                continue  # Still mapped by a viewer on platforms that lock open files
+            total -= size
+
+
+def numpy_to_vtk_image(data, spacing=(1, 1, 1)):
+    """Wrap a volume as vtkImageData, returning it with the buffer the caller must keep alive"""
+    # VTK keeps x fastest, i.e. Fortran order, so a Fortran-ordered volume is shared rather than copied
+    flat = data.ravel(order='F')
+    if not flat.dtype.isnative:
+        flat = flat.astype(flat.dtype.newbyteorder('='))
+    vtk_data_array = numpy_support.numpy_to_vtk(flat, deep=False,
+                                                array_type=numpy_support.get_vtk_array_type(flat.dtype))
+    image = vtk.vtkImageData()
+    image.SetDimensions(data.shape)
+    image.SetSpacing(spacing)
+    image.GetPointData().SetScalars(vtk_data_array)
+    return image, flat
+
+
+def image_transform(geometry):
+    """vtkTransform from world coordinates back to the image coordinates of a volume with this geometry"""
+    transform = vtk.vtkTransform()
+    transform.SetMatrix(tuple(np.linalg.inv(geometry.world_matrix).ravel()))
+    return transform
+
+
+def create_reslice(vtk_image, orientation, position, transform=None):
+    """Axis-aligned 2D reslice of vtk_image at the given world position (in mm) along the orientation's normal.
+
+    transform maps world coordinates to the image's own, see image_transform.
+    """
+    reslice = vtk.vtkImageReslice()
+    reslice.SetInputData(vtk_image)
+    reslice.SetInterpolationModeToLinear()
+    reslice.SetOutputDimensionality(2)
+    axes = vtk.vtkMatrix4x4()
+    axes.DeepCopy(RESLICE_AXES[orientation])
+    reslice.SetResliceAxes(axes)
+    reslice.SetResliceAxesOrigin(*(position if j == orientation else 0 for j in range(3)))
+    if transform is not None:
+        reslice.SetResliceTransform(transform)
+    reslice.Update()
+    return reslice
+
+
+def write_png(image, file_path):
+    """Write a 2D uint8 array as PNG, with row 0 at the bottom as VTK displays it"""
+    vtk_image = vtk.vtkImageData()
+    vtk_image.SetDimensions(image.shape[1], image.shape[0], 1)
+    vtk_image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(np.ascontiguousarray(image).ravel(), deep=True))
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(file_path)
+    writer.SetInputData(vtk_image)
+    writer.Write()
+
+
+def to_display_bytes(image, scalar_range):
+    low, high = scalar_range
+    return (np.clip((image.astype(np.float32) - low) / max(high - low, 1e-6), 0, 1) * 255).astype(np.uint8)
+
+
+def export_study(input_path, output_dir, formats=('png',), orientations=(0, 1, 2), mip=False,
+                 thumbnail_size=256):
+    """Write every slice of a study along each orientation, using the viewer's reslice axes.
+
+    PNG slices and .npy stacks are streamed to disk one slice at a time. With mip, a maximum intensity
+    projection of those same reslice outputs is also written per orientation as a thumbnail, downsampled
+    by the same step along both axes. Returns the number of slices written.
+    """
+    data, _, scalar_range, geometry = load_volume(input_path, max_workers=1)
+    vtk_image, buffer = numpy_to_vtk_image(data, geometry.spacing)
+    transform = image_transform(geometry)
+    # Same-named studies from different folders (p1/ct.nii.gz, p2/ct.nii.gz) must not share an output folder
+    study_path = os.path.abspath(os.path.normpath(input_path))
+    study_name = os.path.basename(study_path).split('.')[0]
+    study_dir = os.path.join(output_dir, f"{study_name}_{hashlib.sha1(study_path.encode()).hexdigest()[:8]}")
+    os.makedirs(study_dir, exist_ok=True)
+
+    written = 0
+    for orientation in orientations:
+        name = ORIENTATIONS[orientation].lower()
+        reslice = create_reslice(vtk_image, orientation, 0, transform)
+        stack, projection = None, None
+        count = data.shape[geometry.axes[orientation]]
+        for position in range(count):
+            origin = list(geometry.origin)
+            origin[orientation] = geometry.slice_position(orientation, position)
+            reslice.SetResliceAxesOrigin(origin)
+            reslice.Update()
+            output = reslice.GetOutput()
+            width, height, _ = output.GetDimensions()
+            image = numpy_support.vtk_to_numpy(output.GetPointData().GetScalars()).reshape(height, width)
+            if 'png' in formats:
+                write_png(to_display_bytes(image, scalar_range), os.path.join(study_dir, f"{name}_{position:04d}.png"))
+            if 'npy' in formats:
+                if stack is None:
+                    stack = np.lib.format.open_memmap(os.path.join(study_dir, f"{name}.npy"), mode='w+',
+                                                      dtype=image.dtype, shape=(count,) + image.shape)
+                stack[position] = image
+            if mip:
+                projection = image.copy() if projection is None else np.maximum(projection, image, out=projection)
+            written += 1
+        if stack is not None:
+            stack.flush()
+            del stack
+        if projection is not None:
+            projection = to_display_bytes(projection, scalar_range)
+            step = max(1, -(-max(projection.shape) // thumbnail_size))
+            write_png(projection[::step, ::step], os.path.join(study_dir, f"{name}_mip.png"))
+    del buffer
+    return written
+
+
+def batch_export(input_paths, output_dir, formats=('png',), orientations=(0, 1, 2), mip=False, max_workers=None):
+    """Export many studies across a process pool; returns the number of studies that failed"""
+    failures = 0
+    with process_pool(max_workers) as executor:
+        futures = {executor.submit(export_study, path, output_dir, formats, orientations, mip): path
+                   for path in input_paths}
+        for future in as_completed(futures):
+            try:
+                print(f"{futures[future]}: wrote {future.result()} slices")
+            except Exception as e:
+                failures += 1
+                print(f"{futures[future]}: failed: {e}", file=sys.stderr)
+    return failures
+
+
+@contextlib.contextmanager
+def track_peak_memory(report):
+    """Call report(peak_bytes) with the peak traced allocation size of the enclosed block"""
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report(peak)
+
+
+def worker_peak_memory():
+    """Largest resident set size, in bytes, of any finished worker process, or None where it is unavailable"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024  # Linux reports kilobytes
+
+
+class DicomSeriesLoader(QtCore.QThread):
+    """Runs load_dicom_directory off the GUI thread; requestInterruption() cancels the load.
+
+    The volume is normalized to uint16 and stored in the cache, when one is given, so reopening maps it from disk.
+    peak_memory is the peak traced allocation size of the load, including decoding and normalization.
+    """
+    progress = QtCore.pyqtSignal(int, int)
+    loaded = QtCore.pyqtSignal(object, object, str)  # volume, geometry, series description
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, directory, cache=None, parent=None):
+        super().__init__(parent)
+        self.directory, self.cache = directory, cache
+        self.peak_memory = 0
+
+    def run(self):
+        try:
+            with track_peak_memory(lambda peak: setattr(self, 'peak_memory', peak)):
+                result = self.load()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        if result is not None:
+            self.loaded.emit(*result)
+
+    def load(self):
+        cached = self.cache.get(self.directory) if self.cache is not None else None
+        if cached is not None:
+            (volume, _, _, geometry), description = cached
+            return volume, geometry, description
+        result = load_dicom_directory(self.directory, self.progress.emit, self.isInterruptionRequested)
+        if result is None:
+            return None
+        volume, series = result
+        volume = volume if volume.dtype == np.uint16 else normalize_to_uint16(volume)
+        geometry, description = VolumeGeometry.from_dicom_series(series), series.description or series.uid
+        if self.cache is not None:
+            self.cache.put(self.directory, (volume, (1.0, 0.0), (0, 65535), geometry), description)
+        return volume, geometry, description
+
+
+def block_average(data, factor):
+    """Mean over blocks of factor voxels per axis, computed one output slice at a time; edge remainders are dropped"""
+    nx, ny, nz = (n // factor for n in data.shape[:3])
+    output = np.empty((nx, ny, nz), dtype=data.dtype, order='F')
+    for k in range(nz):
+        slab = data[:nx * factor, :ny * factor, k * factor:(k + 1) * factor].astype(np.float32)
+        output[:, :, k] = np.rint(slab.reshape(nx, factor, ny, factor, factor).mean(axis=(1, 3, 4)))
+    return output
+
+
+def build_pyramid(data, factors=(2, 4, 8)):
+    """Block-averaged 2x/4x/8x downsampled copies of a volume, skipping levels that would vanish.
+
+    Averaging rather than striding keeps thin bright structures from aliasing while the preview is dragged.
+    Each level is averaged from the previous one, so the full volume is only read once.
+    """
+    levels, source, source_factor = [], data, 1
+    for factor in factors:
+        if min(data.shape[:3]) < 2 * factor:
+            break
+        source, source_factor = block_average(source, factor // source_factor), factor
+        levels.append((factor, source))
+    return levels
+
+
+class PyramidBuilder(QtCore.QThread):
+    """Builds the preview pyramid of a volume in the background and emits it with the source volume."""
+    built = QtCore.pyqtSignal(object, list)
+
+    def __init__(self, data, parent=None):
+        super().__init__(parent)
+        self.data = data
+
+    def run(self):
+        self.built.emit(self.data, build_pyramid(self.data))
+
+
+def extract_isosurface(vtk_image, threshold, max_triangles=200000):
+    """Isosurface of vtk_image at threshold, decimated to at most about max_triangles, as a standalone vtkPolyData"""
+    # Flying edges runs across all cores through VTK's SMP backend
+    contour = vtk.vtkFlyingEdges3D()
+    contour.SetInputData(vtk_image)
+    contour.SetValue(0, threshold)
+    contour.ComputeNormalsOff()
+    contour.ComputeScalarsOff()
+    contour.Update()
+    surface = contour.GetOutput()
+    if surface.GetNumberOfPolys() > max_triangles:
+        decimate = vtk.vtkQuadricDecimation()
+        decimate.SetInputData(surface)
+        decimate.SetTargetReduction(1.0 - max_triangles / surface.GetNumberOfPolys())
+        decimate.Update()
+        surface = decimate.GetOutput()
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(surface)
+    normals.SplittingOff()
+    normals.Update()
+    mesh = vtk.vtkPolyData()
+    mesh.DeepCopy(normals.GetOutput())
+    return mesh
+
+
+def export_mesh(mesh, file_path):
+    """Write a mesh as binary STL or PLY, chosen by the file extension"""
+    writer = vtk.vtkPLYWriter() if file_path.lower().endswith('.ply') else vtk.vtkSTLWriter()
+    writer.SetFileName(file_path)
+    writer.SetInputData(mesh)
+    writer.SetFileTypeToBinary()
+    if not writer.Write():
+        raise IOError(f"Could not write {file_path}")
+
+
+class IsosurfaceBuilder(QtCore.QThread):
+    """Extracts an isosurface in the background and emits it with the image, threshold and budget it was made for."""
+    built = QtCore.pyqtSignal(object, float, int, object)
+
+    def __init__(self, vtk_image, threshold, max_triangles, parent=None):
+        super().__init__(parent)
+        self.vtk_image, self.threshold, self.max_triangles = vtk_image, threshold, max_triangles
+        # The GUI thread keeps reslicing and rendering vtk_image, and VTK pipelines sharing a data object are not
+        # thread-safe; the contour runs on a copy made here, before the thread starts, that shares the scalars
+        self.input = vtk.vtkImageData()
+        self.input.ShallowCopy(vtk_image)
+
+    def run(self):
+        self.built.emit(self.vtk_image, self.threshold, self.max_triangles,
+                        extract_isosurface(self.input, self.threshold, self.max_triangles))
+
+
+def has_hardware_volume_rendering(render_window, volume_property):
+    """True when the GPU ray caster is supported by a real GPU rather than a software OpenGL driver"""
+    if not vtk.vtkGPUVolumeRayCastMapper().IsRenderSupported(render_window, volume_property):
+        return False
+    capabilities = render_window.ReportCapabilities().lower()
+    return not any(name in capabilities for name in ('llvmpipe', 'softpipe', 'swrast', 'basic render'))
+
+
+class SlabProjector:
+    """Running maximum, minimum or mean projection over a slab of slices along one volume axis.
+
+    Moving the slab by one slice only folds in the entering slice and removes the leaving one; a maximum or
+    minimum is recomputed over the slab only at pixels where the leaving slice held the current extreme.
+    The projection is written in place into output, a Fortran-ordered volume one slice thick.
+    """
+    REDUCERS = {'max': (np.max, np.maximum), 'min': (np.min, np.minimum)}
+
+    def __init__(self, data, axis, mode, thickness):
+        self.data, self.axis, self.mode = data, axis, mode
+        self.thickness = max(1, min(thickness, data.shape[axis]))
+        shape = list(data.shape[:3])
+        shape[axis] = 1
+        self.output = np.empty(shape, dtype=np.float32 if mode == 'mean' else data.dtype, order='F')
+        self.projection = self.output.squeeze(axis)
+        self.start, self.total = None, None
+
+    def slab(self, start, stop):
+        index = [slice(None)] * 3
+        index[self.axis] = slice(start, stop)
+        return self.data[tuple(index)]
+
+    def project(self, center):
+        start = int(np.clip(center - self.thickness // 2, 0, self.data.shape[self.axis] - self.thickness))
+        if self.start is not None and abs(start - self.start) == 1:
+            self.step(start)
+        elif start != self.start:
+            self.recompute(start)
+        self.start = start
+        return self.projection
+
+    def recompute(self, start):
+        slab = self.slab(start, start + self.thickness)
+        if self.mode == 'mean':
+            self.total = slab.sum(axis=self.axis, dtype=np.float64)
+            np.divide(self.total, self.thickness, out=self.projection, casting='unsafe')
+        else:
+            self.REDUCERS[self.mode][0](slab, axis=self.axis, out=self.projection)
+
+    def step(self, start):
+        if start > self.start:
+            leaving, entering = self.start, start + self.thickness - 1
+        else:
+            leaving, entering = self.start + self.thickness - 1, start
+        leaving = self.slab(leaving, leaving + 1).squeeze(self.axis)
+        entering = self.slab(entering, entering + 1).squeeze(self.axis)
+        if self.mode == 'mean':
+            self.total += entering
+            self.total -= leaving
+            np.divide(self.total, self.thickness, out=self.projection, casting='unsafe')
+            return
+        reduce, combine = self.REDUCERS[self.mode]
+        stale = leaving == self.projection
+        combine(self.projection, entering, out=self.projection)
+        if stale.any():
+            slab = np.moveaxis(self.slab(start, start + self.thickness), self.axis, 0)
+            self.projection[stale] = reduce(slab[:, stale], axis=0)
+
+
+class CineEngine(QtCore.QObject):
+    """Paces cine playback on a monotonic clock at a target frame rate.
+
+    Each tick emits advance(frames) with the number of frames due since the previous one; when rendering falls
+    behind, the extra frames are skipped rather than queued and counted in dropped_frames.
+    """
+    advance = QtCore.pyqtSignal(int)
+
+    def __init__(self, fps=10.0, parent=None):
+        super().__init__(parent)
+        self.fps = fps
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.frame_times = collections.deque(maxlen=60)
+        self.next_time, self.rendered_frames, self.dropped_frames = 0.0, 0, 0
+
+    def start(self):
+        self.frame_times.clear()
+        self.rendered_frames, self.dropped_frames = 0, 0
+        self.next_time = time.perf_counter()
+        self.timer.start(0)
+
+    def stop(self):
+        self.timer.stop()
+
+    def is_active(self):
+        return self.timer.isActive()
+
+    def measured_fps(self):
+        if len(self.frame_times) < 2:
+            return 0.0
+        return (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-9)
+
+    def tick(self):
+        now = time.perf_counter()
+        due = 1 + int((now - self.next_time) * self.fps) if now >= self.next_time else 1
+        self.dropped_frames += due - 1
+        self.next_time += due / self.fps
+        self.advance.emit(due)
+        self.rendered_frames += 1
+        self.frame_times.append(time.perf_counter())
+        self.timer.start(max(0, int((self.next_time - time.perf_counter()) * 1000)))
+
+
+class RenderScheduler(QtCore.QObject):
+    """Collects views marked dirty and renders each of them once on the next display refresh."""
+
+    def __init__(self, render_view, parent=None):
+        super().__init__(parent)
+        self.render_view, self.dirty = render_view, set()
+        screen = QtWidgets.QApplication.primaryScreen()
+        self.interval = int(1000 / (screen.refreshRate() if screen and screen.refreshRate() > 0 else 60))
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def request(self, *views):
+        self.dirty.update(views)
+        if not self.timer.isActive():
+            self.timer.start(self.interval)
+
+    def flush(self):
+        self.timer.stop()
+        views, self.dirty = self.dirty, set()
+        for view in sorted(views):
+            self.render_view(view)
+
+
+class SegmentationOverlay:
+    """Per-label color, visibility and opacity of a label volume, kept in one lookup table shared by all views.
+
+    Toggling a label only rewrites the 256-entry table, so the label reslices and surfaces are not recomputed.
+    """
+
+    def __init__(self, labels, opacity=0.5):
+        self.labels = labels
+        # Fixed seed, so a label keeps its color between sessions
+        self.colors = np.random.default_rng(7).uniform(0.2, 1.0, (256, 3))
+        self.visible = np.ones(256, dtype=bool)
+        self.visible[0] = False  # Background
+        self.opacity = np.full(256, opacity)
+        self.lut = vtk.vtkLookupTable()
+        self.lut.SetNumberOfTableValues(256)
+        self.lut.SetRange(0, 255)
+        self.lut.Build()
+        self.update_table()
+
+    def update_table(self):
+        table = np.empty((256, 4), dtype=np.uint8)
+        table[:, :3] = self.colors * 255
+        table[:, 3] = self.visible * self.opacity * 255
+        self.lut.SetTable(numpy_support.numpy_to_vtk(table, deep=True, array_type=vtk.VTK_UNSIGNED_CHAR))
+        self.lut.Modified()
+
+    def set_visible(self, label, visible):
+        self.visible[label] = visible
+        self.update_table()
+
+    def set_opacity(self, label, opacity):
+        self.opacity[label] = opacity
+        self.update_table()
+
+
+class MarkLayer:
+    """Landmarks held in a single vtkPoints set and drawn as sphere glyphs, with one actor per renderer."""
+
+    def __init__(self, radius=2, color=(1, 0, 0)):
+        self.points = vtk.vtkPoints()
+        self.poly_data = vtk.vtkPolyData()
+        self.poly_data.SetPoints(self.points)
+        self.sphere = vtk.vtkSphereSource()
+        self.sphere.SetRadius(radius)
+        self.color = color
+
+    def __len__(self):
+        return self.points.GetNumberOfPoints()
+
+    def create_actor(self):
+        # Each render window gets its own mapper; they all glyph the same point set
+        mapper = vtk.vtkGlyph3DMapper()
+        mapper.SetInputData(self.poly_data)
+        mapper.SetSourceConnection(self.sphere.GetOutputPort())
+        mapper.ScalingOff()
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        actor.GetProperty().SetColor(*self.color)
+        return actor
+
+    def add(self, point):
+        self.points.InsertNextPoint(*point)
+        self.points.Modified()
+
+    def set_points(self, points):
+        points = np.ascontiguousarray(np.reshape(points, (-1, 3)), dtype=np.float64)
+        self.points.SetData(numpy_support.numpy_to_vtk(points, deep=True))
+        self.points.Modified()
+
+    def to_array(self):
+        if not len(self):
+            return np.empty((0, 3))
+        return numpy_support.vtk_to_numpy(self.points.GetData()).copy()
 
 
 class MedicalImageViewer(QtWidgets.QMainWindow):
@@ -14,10 +940,30 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         super().__init__()
         self.setWindowTitle("Enhanced Medical Image Viewer")
         self.setGeometry(100, 100, 1600, 900)
-        self.image_data, self.orientation = None, ['Sagittal', 'Coronal', 'Axial']
+        self.image_data, self.orientation = None, ORIENTATIONS
         self.current_slice, self.total_slices, self.playing = [0] * 3, [0] * 3, False
-        self.timer, self.marks = QtCore.QTimer(), []
-        self.timer.timeout.connect(self.play_slices)
+        self.cine, self.marks = CineEngine(), MarkLayer()
+        # Views 0-2 are the MPR planes and 3 the volume; bursts of changes are rendered once per refresh
+        self.render_scheduler = RenderScheduler(self.render_view)
+        self.cine.advance.connect(self.play_slices)
+        self.loader, self.volume_cache = None, VolumeCache()
+        self.luts, self.window_values, self.vtk_buffers = [], None, {}
+        self.rescale, self.scalar_range, self.geometry = (1.0, 0.0), (0, 65535), VolumeGeometry()
+        self.tilts = [0] * 3
+        # Downsampled levels shown while a slice slider is dragged, keyed by factor; 0 is full resolution
+        self.pyramid, self.pyramid_builder, self.plane_levels = {}, None, [0] * 3
+        # Thick-slab projection; axis-aligned views use SlabProjector, tilted views the reslice's own slab mode
+        self.slab_mode, self.slab_thickness = None, 10
+        self.slab_projectors, self.slab_images = [None] * 3, [None] * 3
+        self.refine_timer = QtCore.QTimer()
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.timeout.connect(self.refine_views)
+        self.use_gpu_mapper = None  # Detected on the first 3D setup
+        self.overlay, self.overlay_reslices = None, []
+        # Isosurfaces of the current volume by (threshold, triangle budget), least recently shown first
+        self.meshes, self.surface_actor = collections.OrderedDict(), None
+        # At most one extraction runs; only the latest key requested meanwhile is kept to run after it
+        self.mesh_builder, self.mesh_building, self.pending_mesh_key = None, False, None
         self.setup_ui()
 
     def setup_ui(self):
@@ -45,9 +991,23 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         self.vtk_widgets.append(vtk_widget_3d)
         views_layout.addWidget(vtk_widget_3d)
         vtk_widget_3d.GetRenderWindow().GetInteractor().AddObserver("LeftButtonPressEvent", self.on_left_button_press)
+        # The volume LODs render coarse levels while interacting and full resolution once the view is still
+        vtk_widget_3d.GetRenderWindow().GetInteractor().SetDesiredUpdateRate(15.0)
+        vtk_widget_3d.GetRenderWindow().GetInteractor().SetStillUpdateRate(0.001)
+        renderer_3d.AddObserver("EndEvent", self.on_3d_render_end)
+        self.frame_rate_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.frame_rate_label)
+        self.cine_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.cine_label)
 
         load_button = QtWidgets.QPushButton("Load Image")
         load_button.clicked.connect(self.load_image)
+        import_marks_button = QtWidgets.QPushButton("Import Marks")
+        import_marks_button.clicked.connect(self.import_marks)
+        export_marks_button = QtWidgets.QPushButton("Export Marks")
+        export_marks_button.clicked.connect(self.export_marks)
+        load_labels_button = QtWidgets.QPushButton("Load Labels")
+        load_labels_button.clicked.connect(self.load_labels)
         self.contrast_slider, self.brightness_slider = self.create_slider(), self.create_slider()
 
         play_button = QtWidgets.QPushButton("Play")
@@ -55,16 +1015,84 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         play_button.clicked.connect(self.toggle_play)
 
         controls_layout.addWidget(load_button)
+        controls_layout.addWidget(import_marks_button)
+        controls_layout.addWidget(export_marks_button)
+        controls_layout.addWidget(load_labels_button)
         controls_layout.addWidget(QtWidgets.QLabel("Contrast"))
         controls_layout.addWidget(self.contrast_slider)
         controls_layout.addWidget(QtWidgets.QLabel("Brightness"))
         controls_layout.addWidget(self.brightness_slider)
         controls_layout.addWidget(play_button)
+        self.fps_box = QtWidgets.QSpinBox()
+        self.fps_box.setRange(1, 120)
+        self.fps_box.setValue(int(self.cine.fps))
+        self.fps_box.setSuffix(" fps")
+        self.fps_box.valueChanged.connect(lambda value: setattr(self.cine, 'fps', float(value)))
+        controls_layout.addWidget(self.fps_box)
+
+        self.slab_combo = QtWidgets.QComboBox()
+        self.slab_combo.addItems(["Single Slice", "MIP", "MinIP", "Mean"])
+        self.slab_combo.currentIndexChanged.connect(self.on_slab_change)
+        self.slab_thickness_box = QtWidgets.QSpinBox()
+        self.slab_thickness_box.setRange(2, 500)
+        self.slab_thickness_box.setValue(self.slab_thickness)
+        self.slab_thickness_box.setSuffix(" slices")
+        self.slab_thickness_box.valueChanged.connect(self.on_slab_change)
+        controls_layout.addWidget(QtWidgets.QLabel("Slab"))
+        controls_layout.addWidget(self.slab_combo)
+        controls_layout.addWidget(self.slab_thickness_box)
+
+        # Checkable label list with counts and volumes; the opacity slider applies to the selected labels
+        self.label_list = QtWidgets.QListWidget()
+        self.label_list.setMaximumHeight(100)
+        self.label_list.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.label_list.itemChanged.connect(self.on_label_toggled)
+        self.label_opacity_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.label_opacity_slider.setRange(0, 100)
+        self.label_opacity_slider.setValue(50)
+        self.label_opacity_slider.valueChanged.connect(self.on_label_opacity_change)
+        labels_layout = QtWidgets.QVBoxLayout()
+        labels_layout.addWidget(self.label_list)
+        labels_layout.addWidget(QtWidgets.QLabel("Label Opacity"))
+        labels_layout.addWidget(self.label_opacity_slider)
+        controls_layout.addLayout(labels_layout)
+
+        # Surface mode replaces the volume rendering with a decimated isosurface at the threshold
+        self.render_mode_combo = QtWidgets.QComboBox()
+        self.render_mode_combo.addItems(["Volume", "Surface"])
+        self.render_mode_combo.currentIndexChanged.connect(self.update_3d_mode)
+        self.iso_box = QtWidgets.QDoubleSpinBox()
+        self.iso_box.setDecimals(1)
+        self.iso_box.setRange(-1e6, 1e6)
+        self.iso_box.setKeyboardTracking(False)
+        self.iso_box.valueChanged.connect(self.update_3d_mode)
+        self.triangle_box = QtWidgets.QSpinBox()
+        self.triangle_box.setRange(1000, 5000000)
+        self.triangle_box.setSingleStep(50000)
+        self.triangle_box.setValue(200000)
+        self.triangle_box.setSuffix(" triangles")
+        self.triangle_box.setKeyboardTracking(False)
+        self.triangle_box.valueChanged.connect(self.update_3d_mode)
+        export_mesh_button = QtWidgets.QPushButton("Export Mesh")
+        export_mesh_button.clicked.connect(self.export_surface)
+        surface_layout = QtWidgets.QVBoxLayout()
+        surface_layout.addWidget(self.render_mode_combo)
+        surface_layout.addWidget(self.iso_box)
+        surface_layout.addWidget(self.triangle_box)
+        surface_layout.addWidget(export_mesh_button)
+        controls_layout.addLayout(surface_layout)
 
         self.sliders = [self.create_slider(vertical=True) for _ in range(3)]
-        for i, slider in enumerate(self.sliders):
+        self.tilt_sliders = [self.create_slider() for _ in range(3)]
+        for i, (slider, tilt_slider) in enumerate(zip(self.sliders, self.tilt_sliders)):
             slider.valueChanged.connect(lambda value, idx=i: self.on_slider_change(idx, value))
-            controls_layout.addLayout(self.create_slider_layout(slider, self.orientation[i]))
+            # Tilts the plane about its horizontal axis, in degrees
+            tilt_slider.setRange(-90, 90)
+            tilt_slider.valueChanged.connect(lambda value, idx=i: self.on_tilt_change(idx, value))
+            slider_layout = self.create_slider_layout(slider, self.orientation[i])
+            slider_layout.addWidget(QtWidgets.QLabel("Tilt"), alignment=QtCore.Qt.AlignHCenter)
+            slider_layout.addWidget(tilt_slider)
+            controls_layout.addLayout(slider_layout)
 
         layout.addLayout(views_layout)
         layout.addLayout(controls_layout)
@@ -72,6 +1100,14 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         self.brightness_slider.valueChanged.connect(self.update_window_level)
         self.setup_interactor_styles()
 
+        self.mark_actors = [self.marks.create_actor() for _ in self.renderers]
+        for renderer, actor in zip(self.renderers, self.mark_actors):
+            renderer.AddActor(actor)
+        # Marks are kept in volume coordinates; each 2D view maps them into its reslice plane's frame
+        self.mark_matrices = [vtk.vtkMatrix4x4() for _ in range(3)]
+        for actor, matrix in zip(self.mark_actors, self.mark_matrices):
+            actor.SetUserMatrix(matrix)
+
     def create_slider(self, vertical=False):
         slider = QtWidgets.QSlider(QtCore.Qt.Vertical if vertical else QtCore.Qt.Horizontal)
         slider.setMinimum(-100 if not vertical else 0)
@@ -88,80 +1124,308 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
     def load_image(self):
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Medical Image", "",
                                                              "NIfTI Files (*.nii *.nii.gz);;DICOM Directory (*.dcm);;All Files (*)")
-        if file_path:
+        if not file_path:
+            return
+        if file_path.endswith(('.nii', '.nii.gz')):
             try:
-                self.image_data = (nib.load(file_path).get_fdata() if file_path.endswith(('.nii', '.nii.gz'))
-                                   else self.load_dicom_directory(file_path))
-                if self.image_data.dtype != np.uint16:
-                    self.image_data = self.normalize_to_uint16(self.image_data)
-                self.setup_views()
-                for i in range(3):
-                    self.sliders[i].setMaximum(self.image_data.shape[i] - 1)
-                    self.sliders[i].setValue(self.current_slice[i])
-
-                # ضبط السطوع والتباين الافتراضي
-                self.contrast_slider.setValue(20)  # قيمة تباين متوسطة
-                self.brightness_slider.setValue(30)  # قيمة سطوع متوسطة
-                self.update_window_level()  # تحديث المستوى بعد تعيين القيم الجديدة
-
+                # Slope/intercept are applied lazily, so the mapped file is only paged in where it is viewed
+                with track_peak_memory(self.report_peak_memory):
+                    self.show_volume(*self.open_nifti_cached(file_path))
             except Exception as e:
-                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to load image:\n{str(e)}")
-
-    def normalize_to_uint16(self, data):
-        data_min, data_max = np.min(data), np.max(data)
-        return np.zeros(data.shape, dtype=np.uint16) if data_max - data_min == 0 else \
-            ((data - data_min) / (data_max - data_min) * 65535).astype(np.uint16)
-
-    def load_dicom_directory(self, directory):
-        files = [os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith('.dcm')]
-        if not files:
-            raise ValueError("No DICOM files found in the directory.")
-        dicoms = sorted([pydicom.dcmread(f) for f in files],
-                        key=lambda x: float(
-                            x.ImagePositionPatient[2]) if 'ImagePositionPatient' in x else x.InstanceNumber)
-        return np.stack([d.pixel_array for d in dicoms], axis=-1)
-
-    def numpy_to_vtk_image(self, data):
-        vtk_data_array = numpy_support.numpy_to_vtk(data.flatten(order='F'), deep=True,
-                                                    array_type=vtk.VTK_UNSIGNED_SHORT)
-        image = vtk.vtkImageData()
-        image.SetDimensions(data.shape)
-        image.GetPointData().SetScalars(vtk_data_array)
+                self.show_load_error(e)
+        else:
+            self.start_dicom_loader(file_path if os.path.isdir(file_path) else os.path.dirname(file_path))
+
+    def open_nifti_cached(self, file_path):
+        # Uncompressed files are already memory-mapped; only decompressed .nii.gz volumes are worth caching
+        if not file_path.endswith('.gz'):
+            return open_nifti(file_path)
+        cached = self.volume_cache.get(file_path)
+        if cached is not None:
+            return cached[0]
+        volume = open_nifti(file_path)
+        self.volume_cache.put(file_path, volume)
+        return volume
+
+    def start_dicom_loader(self, directory):
+        if self.loader is not None and self.loader.isRunning():
+            return
+        progress_dialog = QtWidgets.QProgressDialog("Loading DICOM series...", "Cancel", 0, 0, self)
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+
+        self.loader = DicomSeriesLoader(directory, self.volume_cache, self)
+        self.loader.progress.connect(lambda done, total: (progress_dialog.setMaximum(total),
+                                                          progress_dialog.setValue(done)))
+        self.loader.loaded.connect(self.show_loaded_series)
+        self.loader.failed.connect(self.show_load_error)
+        self.loader.finished.connect(progress_dialog.close)
+        progress_dialog.canceled.connect(self.loader.requestInterruption)
+        self.loader.start()
+
+    def show_load_error(self, error):
+        QtWidgets.QMessageBox.critical(self, "Error", f"Failed to load image:\n{str(error)}")
+
+    def show_loaded_series(self, data, geometry, description):
+        self.setWindowTitle(f"Enhanced Medical Image Viewer - {description}")
+        # Decoding ran in the loader thread and its worker processes; display setup is traced here
+        loader_peak = self.loader.peak_memory
+        with track_peak_memory(lambda peak: self.report_peak_memory(max(peak, loader_peak), worker_peak_memory())):
+            self.show_volume(data, geometry=geometry)
+
+    def report_peak_memory(self, peak, worker_peak=None):
+        if self.image_data is not None:
+            message = (f"Volume {self.image_data.nbytes / 2 ** 20:.0f} MB, "
+                       f"peak traced memory while loading {peak / 2 ** 20:.0f} MB")
+            if worker_peak:
+                message += f", largest worker process {worker_peak / 2 ** 20:.0f} MB"
+            self.statusBar().showMessage(message)
+
+    def show_volume(self, data, rescale=(1.0, 0.0), scalar_range=None, geometry=None):
+        """Display a volume of stored values; without a scalar_range it is first normalized to uint16"""
+        try:
+            if scalar_range is None:
+                data = data if data.dtype == np.uint16 else normalize_to_uint16(data)
+                scalar_range = (0, 65535)
+            self.image_data, self.rescale, self.scalar_range = data, rescale, scalar_range
+            self.geometry = geometry or VolumeGeometry()
+            slope, intercept = rescale
+            # DICOM series are percentile-normalized to 0-65535, so no fixed threshold such as a bone HU fits
+            # every volume; each one starts at the middle of its display range
+            low, high = sorted(v * slope + intercept for v in scalar_range)
+            self.iso_box.blockSignals(True)
+            self.iso_box.setRange(low, high)
+            self.iso_box.setValue((low + high) / 2)
+            self.iso_box.blockSignals(False)
+            self.setup_views()
+            for i in range(3):
+                self.sliders[i].setMaximum(self.total_slices[i] - 1)
+                self.sliders[i].setValue(self.current_slice[i])
+
+            # ضبط السطوع والتباين الافتراضي
+            self.contrast_slider.setValue(20)  # قيمة تباين متوسطة
+            self.brightness_slider.setValue(30)  # قيمة سطوع متوسطة
+            self.update_window_level()  # تحديث المستوى بعد تعيين القيم الجديدة
+
+        except Exception as e:
+            self.show_load_error(e)
+
+    def numpy_to_vtk_image(self, data, spacing, slot):
+        image, buffer = numpy_to_vtk_image(data, spacing)
+        # VTK does not own shallow-copied memory; keep it alive until the image in the same slot is replaced
+        self.vtk_buffers[slot] = buffer
         return image
 
     def setup_views(self):
         if self.image_data is None:
             return
-        self.total_slices = self.image_data.shape
+        # Views follow the world (RAS) axes; each one steps through the volume axis closest to its normal
+        self.total_slices = [self.image_data.shape[axis] for axis in self.geometry.axes]
         self.current_slice = [dim // 2 for dim in self.total_slices]
-        for renderer in self.renderers:
+        for renderer, mark_actor in zip(self.renderers, self.mark_actors):
             renderer.RemoveAllViewProps()
-        vtk_image = self.numpy_to_vtk_image(self.image_data)
+            renderer.AddActor(mark_actor)
+        self.vtk_buffers, self.pyramid, self.plane_levels = {}, {}, [0] * 3
+        self.slab_projectors, self.slab_images = [None] * 3, [None] * 3
+        self.overlay, self.overlay_reslices = None, []
+        self.label_list.clear()
+        self.meshes.clear()
+        self.pending_mesh_key = None
+        self.surface_actor = None
+        # Images stay in their stored axis order: reslices map world to image coordinates through image_transform
+        # and 3D props map image to world coordinates through world_matrix
+        self.image_transform = image_transform(self.geometry)
+        self.world_matrix = vtk.vtkMatrix4x4()
+        self.world_matrix.DeepCopy(tuple(self.geometry.world_matrix.ravel()))
+        self.full_image = vtk_image = self.numpy_to_vtk_image(self.image_data, self.geometry.spacing, 'volume')
+        self.volume_center = list(self.geometry.index_to_world([(n - 1) / 2 for n in self.image_data.shape[:3]]))
         self.planes = [self.create_image_reslice(vtk_image, i) for i in range(3)]
+        for i in range(3):
+            self.configure_plane_slab(i)
+            self.apply_plane_input(i)
         self.actors = self.setup_actors()
 
         # إعداد الـ 3D View
         self.setup_3d_view(vtk_image)
 
+        self.pyramid_builder = PyramidBuilder(self.image_data, self)
+        self.pyramid_builder.built.connect(self.on_pyramid_built)
+        self.pyramid_builder.start()
+
+    def on_pyramid_built(self, data, levels):
+        if data is not self.image_data:
+            return  # a different volume was loaded while this pyramid was being built
+        for factor, level in levels:
+            # Spacing of the factor keeps each level in the same world coordinates as the full volume; each sample
+            # sits at the center of the block it averages
+            image = self.numpy_to_vtk_image(level, [factor * s for s in self.geometry.spacing], ('pyramid', factor))
+            image.SetOrigin([(factor - 1) / 2 * s for s in self.geometry.spacing])
+            self.pyramid[factor] = image
+            self.add_volume_lod(image, factor)
+
+    def set_plane_level(self, view_index, factor):
+        if self.plane_levels[view_index] != factor:
+            self.plane_levels[view_index] = factor
+            self.apply_plane_input(view_index)
+
+    def uses_slab_projector(self, view_index):
+        return self.slab_mode is not None and not self.tilts[view_index]
+
+    def apply_plane_input(self, view_index):
+        if self.uses_slab_projector(view_index):
+            self.update_slab(view_index)
+            image = self.slab_images[view_index]
+        elif self.plane_levels[view_index]:
+            image = self.pyramid[self.plane_levels[view_index]]
+        else:
+            image = self.full_image
+        if self.planes[view_index].GetInput() is not image:
+            self.planes[view_index].SetInputData(image)
+
+    def configure_plane_slab(self, view_index):
+        # Tilted planes cannot use the axis-aligned projector, so the reslice integrates the slab itself
+        reslice = self.planes[view_index]
+        if self.slab_mode is not None and self.tilts[view_index]:
+            {'max': reslice.SetSlabModeToMax, 'min': reslice.SetSlabModeToMin,
+             'mean': reslice.SetSlabModeToMean}[self.slab_mode]()
+            reslice.SetSlabNumberOfSlices(self.slab_thickness)
+        else:
+            reslice.SetSlabNumberOfSlices(1)
+
+    def on_slab_change(self, *_):
+        self.slab_mode = [None, 'max', 'min', 'mean'][self.slab_combo.currentIndex()]
+        self.slab_thickness = self.slab_thickness_box.value()
+        self.slab_projectors, self.slab_images = [None] * 3, [None] * 3
+        for i in range(3):
+            self.vtk_buffers.pop(('slab', i), None)  # Planes are given their new inputs below, before any render
+        if self.image_data is None:
+            return
+        for i in range(3):
+            self.configure_plane_slab(i)
+            self.apply_plane_input(i)
+        self.render_scheduler.request(0, 1, 2)
+
+    def update_slab(self, view_index):
+        """Slide the view's slab projection to the current slice, creating its projector on first use"""
+        projector = self.slab_projectors[view_index]
+        if projector is None:
+            projector = SlabProjector(self.image_data, self.geometry.axes[view_index], self.slab_mode,
+                                      self.slab_thickness)
+            self.slab_projectors[view_index] = projector
+            self.slab_images[view_index] = self.numpy_to_vtk_image(projector.output, self.geometry.spacing,
+                                                                   ('slab', view_index))
+        projector.project(self.current_slice[view_index])
+        # The one-slice image sits on the current plane, so the reslice samples the projection there
+        origin, axis = [0.0, 0.0, 0.0], self.geometry.axes[view_index]
+        origin[axis] = self.current_slice[view_index] * self.geometry.spacing[axis]
+        image = self.slab_images[view_index]
+        image.SetOrigin(origin)
+        image.GetPointData().GetScalars().Modified()
+        image.Modified()
+
+    def refine_views(self):
+        for i in range(3):
+            if self.plane_levels[i]:
+                self.set_plane_level(i, 0)
+                self.render_scheduler.request(i)
+
+    def load_labels(self):
+        if self.image_data is None:
+            return
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Label Map", "",
+                                                             "NIfTI Files (*.nii *.nii.gz);;All Files (*)")
+        if file_path:
+            try:
+                self.show_overlay(load_label_map(file_path, self.image_data.shape))
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to load label map:\n{str(e)}")
+
+    def show_overlay(self, labels):
+        """Blend a label volume over the three planes and show its label surfaces in the 3D view"""
+        if self.overlay is not None:
+            for renderer, actor in zip(self.renderers, self.overlay_actors):
+                renderer.RemoveViewProp(actor)
+        self.overlay = SegmentationOverlay(labels, self.label_opacity_slider.value() / 100)
+        label_image = self.numpy_to_vtk_image(labels, self.geometry.spacing, 'labels')
+        self.overlay_reslices, self.overlay_actors = [], []
+        for i in range(3):
+            # Sharing the plane's axes matrix keeps the labels on the same (possibly oblique) slice
+            reslice = vtk.vtkImageReslice()
+            reslice.SetInputData(label_image)
+            reslice.SetOutputDimensionality(2)
+            reslice.SetInterpolationModeToNearestNeighbor()
+            reslice.SetResliceAxes(self.planes[i].GetResliceAxes())
+            reslice.SetResliceTransform(self.image_transform)
+            colors = vtk.vtkImageMapToColors()
+            colors.SetLookupTable(self.overlay.lut)
+            colors.SetInputConnection(reslice.GetOutputPort())
+            actor = vtk.vtkImageActor()
+            actor.GetMapper().SetInputConnection(colors.GetOutputPort())
+            actor.SetPosition(0, 0, 0.01)  # Just in front of the grayscale slice
+            self.renderers[i].AddActor(actor)
+            self.overlay_reslices.append(reslice)
+            self.overlay_actors.append(actor)
+
+        statistics = label_statistics(labels, self.geometry.spacing)
+        surfaces = vtk.vtkDiscreteFlyingEdges3D()
+        surfaces.SetInputData(label_image)
+        surfaces.ComputeScalarsOn()  # Label values colour the surfaces through the overlay table
+        for j, (label, _, _) in enumerate(statistics):
+            surfaces.SetValue(j, label)
+        surface_mapper = vtk.vtkPolyDataMapper()
+        surface_mapper.SetInputConnection(surfaces.GetOutputPort())
+        surface_mapper.SetLookupTable(self.overlay.lut)
+        surface_mapper.SetScalarRange(0, 255)
+        surface_actor = vtk.vtkActor()
+        surface_actor.SetMapper(surface_mapper)
+        surface_actor.SetUserMatrix(self.world_matrix)
+        self.renderers[-1].AddActor(surface_actor)
+        self.overlay_actors.append(surface_actor)
+
+        self.label_list.blockSignals(True)
+        self.label_list.clear()
+        for label, count, volume in statistics:
+            item = QtWidgets.QListWidgetItem(f"Label {label}: {count} voxels, {volume:.1f} ml")
+            item.setData(QtCore.Qt.UserRole, label)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked)
+            item.setForeground(QtGui.QColor(*(self.overlay.colors[label] * 255).astype(int)))
+            self.label_list.addItem(item)
+        self.label_list.blockSignals(False)
+        self.update_all_views()
+
+    def on_label_toggled(self, item):
+        if self.overlay is not None:
+            self.overlay.set_visible(item.data(QtCore.Qt.UserRole), item.checkState() == QtCore.Qt.Checked)
+            self.update_all_views()
+
+    def on_label_opacity_change(self, value):
+        if self.overlay is None:
+            return
+        items = self.label_list.selectedItems() or [self.label_list.item(k) for k in range(self.label_list.count())]
+        for item in items:
+            self.overlay.opacity[item.data(QtCore.Qt.UserRole)] = value / 100
+        self.overlay.update_table()
+        self.update_all_views()
+
     def create_image_reslice(self, vtk_image, i):
-        reslice = vtk.vtkImageReslice()
-        reslice.SetInputData(vtk_image)
-        reslice.SetInterpolationModeToLinear()
-        reslice.SetOutputDimensionality(2)
-        axes = vtk.vtkMatrix4x4()
-        axes.DeepCopy((0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1) if i == 0 else
-                      (1, 0, 0, 0, 0, 0, 1, 0, 0, -1, 0, 0, 0, 0, 0, 1) if i == 1 else
-                      (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1))
-        reslice.SetResliceAxes(axes)
-        reslice.SetResliceAxesOrigin(*(self.current_slice[i] if j == i else 0 for j in range(3)))
-        reslice.Update()
+        reslice = create_reslice(vtk_image, i, self.geometry.slice_position(i, self.current_slice[i]),
+                                 self.image_transform)
+        reslice.GetResliceAxes().DeepCopy(oblique_axes(i, self.tilts[i]))
         return reslice
 
     def setup_actors(self):
         actors = []
+        self.luts, self.window_values = [], None  # new tables are filled by the next update_window_level
         for i, renderer in enumerate(self.renderers[:-1]):  # exclude the last renderer for 3D
+            lut = vtk.vtkLookupTable()
+            lut.SetNumberOfTableValues(256)
+            lut.SetRange(*self.scalar_range)  # Stored values, before any rescale slope/intercept
+            lut.Build()
             mapper = vtk.vtkImageMapToColors()
+            mapper.SetLookupTable(lut)
             mapper.SetInputConnection(self.planes[i].GetOutputPort())
+            self.luts.append(lut)
             actor = vtk.vtkImageActor()
             actor.GetMapper().SetInputConnection(mapper.GetOutputPort())
             renderer.AddActor(actor)
@@ -171,45 +1435,164 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         return actors
 
     def setup_3d_view(self, vtk_image):
-        volume = vtk.vtkVolume()
-        volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
+        self.volume_property = vtk.vtkVolumeProperty()
+        self.volume_property.SetColor(self.create_volume_color())
+        self.volume_property.SetScalarOpacity(self.create_volume_opacity())
+
+        # Pyramid levels are added as further LODs; VTK picks one that fits the interactive frame time
+        self.volume_lod = vtk.vtkLODProp3D()
+        self.volume_lod.SetUserMatrix(self.world_matrix)
+        self.add_volume_lod(vtk_image)
+
+        self.renderers[-1].AddViewProp(self.volume_lod)  # Add to the last renderer (3D)
+        self.renderers[-1].ResetCamera()
+        self.update_3d_mode()
+
+    def add_volume_lod(self, vtk_image, level=0):
+        # Higher levels are coarser; among LODs that fit the frame time the prop picks the lowest level
+        lod_id = self.volume_lod.AddLOD(self.create_volume_mapper(vtk_image), self.volume_property, 0.0)
+        self.volume_lod.SetLODLevel(lod_id, level)
+
+    def create_volume_mapper(self, vtk_image):
+        if self.use_gpu_mapper is None:
+            self.use_gpu_mapper = has_hardware_volume_rendering(self.vtk_widgets[-1].GetRenderWindow(),
+                                                                self.volume_property)
+        if self.use_gpu_mapper:
+            volume_mapper = vtk.vtkGPUVolumeRayCastMapper()
+        else:
+            # Multi-threaded CPU ray casting for machines without a usable GPU
+            volume_mapper = vtk.vtkFixedPointVolumeRayCastMapper()
+            volume_mapper.SetNumberOfThreads(os.cpu_count() or 1)
+            volume_mapper.SetMinimumImageSampleDistance(1.0)
+            volume_mapper.SetMaximumImageSampleDistance(8.0)
+            volume_mapper.SetInteractiveSampleDistance(2.0)
+        # Coarsen the sample distance and image reduction to meet the interactor's update rate
+        volume_mapper.SetAutoAdjustSampleDistances(1)
         volume_mapper.SetInputData(vtk_image)
+        return volume_mapper
 
-        volume_property = vtk.vtkVolumeProperty()
-        volume_property.SetColor(self.create_volume_color())
-        volume_property.SetScalarOpacity(self.create_volume_opacity())
+    def iso_threshold(self):
+        """The isosurface threshold in stored values; the spin box shows it with the rescale applied"""
+        slope, intercept = self.rescale
+        return (self.iso_box.value() - intercept) / slope
 
-        volume.SetMapper(volume_mapper)
-        volume.SetProperty(volume_property)
+    def update_3d_mode(self, *_):
+        if self.image_data is None:
+            return
+        surface_mode = self.render_mode_combo.currentIndex() == 1
+        self.volume_lod.SetVisibility(not surface_mode)
+        if self.surface_actor is not None:
+            self.surface_actor.SetVisibility(surface_mode)
+        if surface_mode:
+            key = (self.iso_threshold(), self.triangle_box.value())
+            if key in self.meshes:
+                self.meshes.move_to_end(key)
+                self.show_surface(self.meshes[key])
+            else:
+                self.request_isosurface(key)
+        self.render_scheduler.request(3)
 
-        self.renderers[-1].AddVolume(volume)  # Add to the last renderer (3D)
-        self.renderers[-1].ResetCamera()
+    def request_isosurface(self, key):
+        if self.mesh_building:
+            self.pending_mesh_key = key  # Replaces an older pending key
+            return
+        self.mesh_building, self.pending_mesh_key = True, None
+        self.mesh_builder = IsosurfaceBuilder(self.full_image, *key, self)
+        self.mesh_builder.built.connect(self.on_isosurface_built)
+        self.mesh_builder.finished.connect(self.on_isosurface_finished)
+        self.statusBar().showMessage("Extracting isosurface...")
+        self.mesh_builder.start()
+
+    def on_isosurface_finished(self):
+        self.mesh_building = False
+        key, self.pending_mesh_key = self.pending_mesh_key, None
+        # Keys the controls have moved past since they were requested are skipped
+        if (key is not None and key not in self.meshes and self.render_mode_combo.currentIndex() == 1
+                and key == (self.iso_threshold(), self.triangle_box.value())):
+            self.request_isosurface(key)
+
+    def on_isosurface_built(self, vtk_image, threshold, max_triangles, mesh):
+        if vtk_image is not self.full_image:
+            return  # a different volume was loaded while this surface was being extracted
+        self.meshes[(threshold, max_triangles)] = mesh
+        while len(self.meshes) > 8:
+            self.meshes.popitem(last=False)
+        self.statusBar().showMessage(f"Isosurface: {mesh.GetNumberOfPolys()} triangles")
+        if (threshold, max_triangles) == (self.iso_threshold(), self.triangle_box.value()):
+            self.show_surface(mesh)
+
+    def show_surface(self, mesh):
+        if self.surface_actor is None:
+            self.surface_actor = vtk.vtkActor()
+            self.surface_actor.SetMapper(vtk.vtkPolyDataMapper())
+            self.surface_actor.GetProperty().SetColor(0.95, 0.9, 0.8)
+            self.surface_actor.SetUserMatrix(self.world_matrix)
+            self.renderers[-1].AddActor(self.surface_actor)
+        self.surface_actor.GetMapper().SetInputData(mesh)
+        self.surface_actor.SetVisibility(self.render_mode_combo.currentIndex() == 1)
+        self.render_scheduler.request(3)
+
+    def export_surface(self):
+        key = (self.iso_threshold(), self.triangle_box.value())
+        if key not in self.meshes:
+            QtWidgets.QMessageBox.information(self, "Export Mesh", "Switch the 3D view to Surface mode first.")
+            return
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Mesh", "", "STL Files (*.stl);;PLY Files (*.ply)")
+        if file_path:
+            try:
+                export_mesh(self.meshes[key], file_path)
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to export mesh:\n{str(e)}")
+
+    def on_3d_render_end(self, renderer, event):
+        render_time = renderer.GetLastRenderTimeInSeconds()
+        if render_time > 0 and self.use_gpu_mapper is not None:
+            backend = "GPU" if self.use_gpu_mapper else "CPU"
+            self.frame_rate_label.setText(f"3D ({backend}): {1.0 / render_time:.1f} fps")
 
     def create_volume_color(self):
+        low, high = self.scalar_range  # Stored values, like the 2D lookup tables
         color_func = vtk.vtkColorTransferFunction()
-        color_func.AddRGBPoint(0, 0, 0, 0)  # Black
-        color_func.AddRGBPoint(255, 1, 1, 1)  # White
+        color_func.AddRGBPoint(low, 0, 0, 0)  # Black
+        color_func.AddRGBPoint(high, 1, 1, 1)  # White
         return color_func
 
     def create_volume_opacity(self):
+        low, high = self.scalar_range
         opacity_func = vtk.vtkPiecewiseFunction()
-        opacity_func.AddPoint(0, 0.0)  # Fully transparent
-        opacity_func.AddPoint(255, 1.0)  # Fully opaque
+        opacity_func.AddPoint(low, 0.0)  # Fully transparent
+        opacity_func.AddPoint(high, 1.0)  # Fully opaque
         return opacity_func
 
     def update_all_views(self):
-        for i in range(3):
-            self.update_view(i)
-        for renderer in self.renderers:
-            renderer.GetRenderWindow().Render()
+        self.render_scheduler.request(0, 1, 2, 3)
+
+    def render_view(self, view_index):
+        if view_index < 3:
+            self.update_view(view_index)
+        self.vtk_widgets[view_index].GetRenderWindow().Render()
 
     def update_view(self, view_index):
         if self.image_data is None:
             return
-        origin = [0, 0, 0]
-        origin[view_index] = self.current_slice[view_index]
+        if self.uses_slab_projector(view_index):
+            self.update_slab(view_index)
+        # The plane passes through the volume center, offset along its axis to the current slice
+        origin = list(self.volume_center)
+        origin[view_index] = self.geometry.slice_position(view_index, self.current_slice[view_index])
         self.planes[view_index].SetResliceAxesOrigin(origin)
         self.planes[view_index].Update()
+        vtk.vtkMatrix4x4.Invert(self.planes[view_index].GetResliceAxes(), self.mark_matrices[view_index])
+
+    def on_tilt_change(self, view_index, value):
+        self.tilts[view_index] = value
+        if self.image_data is None:
+            return
+        # Matrices come from the oblique_axes cache and are copied into the existing reslice axes
+        self.planes[view_index].GetResliceAxes().DeepCopy(oblique_axes(view_index, value))
+        self.configure_plane_slab(view_index)
+        self.apply_plane_input(view_index)
+        self.render_scheduler.request(view_index)
 
     def update_window_level(self):
         if self.image_data is None:
@@ -217,48 +1600,53 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
 
         contrast = self.contrast_slider.value() / 100.0
         brightness = self.brightness_slider.value()  # Adjust as necessary
+        if (contrast, brightness) == self.window_values:
+            return
+        self.window_values = (contrast, brightness)
 
-        for i in range(3):
-            lut = vtk.vtkLookupTable()
-            lut.SetRange(0, 65535)  # Assuming normalized data is in this range
-            lut.SetValueRange(0, 1)  # Color range
-
-            for j in range(256):
-                # Calculate adjusted value (you can customize this if needed)
-                adjusted_value = (j - 128) * (1 + contrast) + brightness + 128
-                adjusted_value = max(0, min(255, adjusted_value))  # Clamp to [0, 255]
-
-                # Set the color to white
-                if adjusted_value > 128:  # Set bright values to white
-                    lut.SetTableValue(j, 1.0, 1.0, 1.0, 1.0)  # White color
-                else:
-                    lut.SetTableValue(j, 0.0, 0.0, 0.0, 1.0)  # Black for darker values
+        # Adjusted value per table entry, clamped to [0, 255]; bright values are white, darker values black
+        adjusted = np.clip((np.arange(256) - 128) * (1 + contrast) + brightness + 128, 0, 255)
+        table = np.zeros((256, 4), dtype=np.uint8)
+        table[adjusted > 128, :3] = 255
+        table[:, 3] = 255
+        vtk_table = numpy_support.numpy_to_vtk(table, deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+        for lut in self.luts:
+            lut.SetTable(vtk_table)
+            lut.Modified()
 
-            lut.Build()
-            mapper = vtk.vtkImageMapToColors()
-            mapper.SetLookupTable(lut)
-            mapper.SetInputConnection(self.planes[i].GetOutputPort())
-            self.actors[i].GetMapper().SetInputConnection(mapper.GetOutputPort())
-
-        self.update_all_views()
+        self.render_scheduler.request(0, 1, 2)  # the volume's transfer functions do not use these tables
 
     def toggle_play(self, checked):
         self.playing = checked
         if checked:
-            self.timer.start(100)
+            self.cine.start()
         else:
-            self.timer.stop()
+            self.cine.stop()
 
-    def play_slices(self):
+    def play_slices(self, frames=1):
+        if self.image_data is None:
+            return
         for i in range(3):
-            self.current_slice[i] = (self.current_slice[i] + 1) % self.total_slices[i]
+            self.current_slice[i] = (self.current_slice[i] + frames) % self.total_slices[i]
+            # Blocked signals keep the sliders from reslicing and rendering each view on their own
+            self.sliders[i].blockSignals(True)
             self.sliders[i].setValue(self.current_slice[i])
-        self.update_all_views()
+            self.sliders[i].blockSignals(False)
+        # One render per 2D window per frame, flushed now so the engine measures it; the 3D view is untouched
+        self.render_scheduler.request(0, 1, 2)
+        self.render_scheduler.flush()
+        self.cine_label.setText(f"Cine: {self.cine.measured_fps():.1f}/{self.cine.fps:.0f} fps, "
+                                f"{self.cine.dropped_frames} dropped")
 
     def on_slider_change(self, view_index, value):
         self.current_slice[view_index] = value
-        self.update_view(view_index)
-        self.update_window_level()  # Ensure the window level is updated if needed
+        if (self.image_data is not None and self.sliders[view_index].isSliderDown() and self.pyramid
+                and self.slab_mode is None):
+            # Show the finest preview level while dragging; refine_views restores full resolution
+            self.set_plane_level(view_index, min(self.pyramid))
+            self.refine_timer.start(250)
+        if self.image_data is not None:
+            self.render_scheduler.request(view_index)
 
     def on_left_button_press(self, obj, event):
         interactor = obj.GetRenderWindow().GetInteractor()
@@ -269,11 +1657,22 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         picker.Pick(click_pos[0], click_pos[1], 0, interactor.GetRenderWindow().GetRenderers().GetFirstRenderer())
 
         click_position = picker.GetPickPosition()
-        if click_position:
+        if click_position and self.image_data is not None:
+            view_index = [w.GetRenderWindow().GetInteractor() for w in self.vtk_widgets].index(interactor)
+            if view_index < 3:
+                # 2D views show the reslice output, whose coordinates are in the (possibly oblique) plane's frame
+                click_position = self.planes[view_index].GetResliceAxes().MultiplyPoint(
+                    (click_position[0], click_position[1], 0, 1))[:3]
             voxel = self.convert_world_to_voxel(click_position)
             if voxel:
-                self.marks.append(voxel)
+                self.marks.add(self.geometry.index_to_world(voxel))
                 self.update_marks()
+                # Only the picked voxel is read, and the rescale is applied to it alone
+                slope, intercept = self.rescale
+                value = float(self.image_data[tuple(voxel)]) * slope + intercept
+                patient = self.geometry.index_to_patient(voxel)
+                self.statusBar().showMessage(f"Voxel {tuple(voxel)} at ({patient[0]:.1f}, {patient[1]:.1f}, "
+                                             f"{patient[2]:.1f}) mm: {value:g}")
 
         # Re-enable the default interaction style after handling the click
         interactor.SetInteractorStyle(vtk.vtkInteractorStyleImage())
@@ -291,27 +1690,53 @@ class MedicalImageViewer(QtWidgets.QMainWindow):
         return picker.GetPickPosition()
 
     def convert_world_to_voxel(self, pos):
-        voxel = [int(round(p)) for p in pos]
+        voxel = [int(round(v)) for v in self.geometry.world_to_index(pos)]
         return voxel if all(0 <= v < self.image_data.shape[i] for i, v in enumerate(voxel)) else None
 
     def update_marks(self):
-        for renderer in self.renderers:
-            for mark in self.marks:
-                sphere = vtk.vtkSphereSource()
-                sphere.SetCenter(*mark)
-                sphere.SetRadius(2)
-                mapper = vtk.vtkPolyDataMapper()
-                mapper.SetInputConnection(sphere.GetOutputPort())
-                actor = vtk.vtkActor()
-                actor.SetMapper(mapper)
-                actor.GetProperty().SetColor(1, 0, 0)
-                renderer.AddActor(actor)
-        for renderer in self.renderers:
-            renderer.GetRenderWindow().Render()
+        self.render_scheduler.request(0, 1, 2, 3)
+
+    def import_marks(self):
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Import Marks", "", "CSV Files (*.csv);;All Files (*)")
+        if file_path:
+            try:
+                self.marks.set_points(np.loadtxt(file_path, delimiter=',', ndmin=2))
+                self.update_marks()
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to import marks:\n{str(e)}")
+
+    def export_marks(self):
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Marks", "", "CSV Files (*.csv)")
+        if file_path:
+            try:
+                np.savetxt(file_path, self.marks.to_array(), delimiter=',', fmt='%g')
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(self, "Error", f"Failed to export marks:\n{str(e)}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Multi-planar medical image viewer")
+    parser.add_argument("--export", nargs="+", metavar="INPUT",
+                        help="export slices of NIfTI files or DICOM directories without opening the viewer")
+    parser.add_argument("--output", default="mpr_export", help="directory for exported studies")
+    parser.add_argument("--format", nargs="+", choices=["png", "npy"], default=["png"], dest="formats")
+    parser.add_argument("--views", nargs="+", choices=[o.lower() for o in ORIENTATIONS],
+                        default=[o.lower() for o in ORIENTATIONS])
+    parser.add_argument("--mip", action="store_true", help="also write a MIP thumbnail per view")
+    parser.add_argument("--workers", type=int, help="number of studies exported in parallel")
+    return parser.parse_known_args(argv)
 
 
 def main():
-    app = QtWidgets.QApplication(sys.argv)
+    args, qt_args = parse_args(sys.argv[1:])
+    if args.export:
+        orientations = [[o.lower() for o in ORIENTATIONS].index(view) for view in args.views]
+        start = time.perf_counter()
+        failures = batch_export(args.export, args.output, args.formats, orientations, args.mip, args.workers)
+        print(f"Exported {len(args.export) - failures}/{len(args.export)} studies in {time.perf_counter() - start:.1f} s")
+        sys.exit(1 if failures else 0)
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     window = MedicalImageViewer()
     window.show()
     sys.exit(app.exec_())